@@ -11,17 +11,22 @@ from streamlit_option_menu import option_menu
 
 
 
-from db_gsheets import (
-    init_db, seed_foods_if_empty,
-    list_categories, list_foods_by_category, add_food,
-    add_entry, list_entries_by_date, daily_totals_last_days,
-    set_setting, get_setting,
-    list_all_foods, update_food, delete_food_by_id,
-    update_entry, delete_entry_by_id
-)
+from storage import get_backend, backend_name, TAB_FOODS, TAB_ENTRIES
 from core import scale_macros, calculate_goals
 from your_foods import FOODS
 
+# Backend de datos (STORAGE_BACKEND en secrets: sheets / sqlite / memory)
+db = get_backend()
+
+
+@st.cache_resource(show_spinner=False)
+def init_storage() -> bool:
+    """Una vez por proceso: esquema/pestañas y, en backends locales vacíos, la lista de alimentos base."""
+    db.init_db()
+    if backend_name() != "sheets":
+        db.seed_foods_if_empty(FOODS)
+    return True
+
 CATEGORIAS_FIJAS = [
     "🥩 Proteina Animal",
     "🌱 Proteina Vegetal",
@@ -550,26 +555,28 @@ section.main > div{
 # =========================
 # Cache helpers (Google Sheets)
 # =========================
+# `ver` = db.data_version(...): las escrituras invalidan solo la pestaña
+# (y el usuario) afectados, sin st.cache_data.clear() global.
 
 @st.cache_data(ttl=30, show_spinner=False)
-def cached_list_categories():
-    return list_categories()
+def cached_list_categories(ver: int):
+    return db.list_categories()
 
 @st.cache_data(ttl=30, show_spinner=False)
-def cached_list_all_foods():
-    return list_all_foods()
+def cached_list_all_foods(ver: int):
+    return db.list_all_foods()
 
 @st.cache_data(ttl=30, show_spinner=False)
-def cached_list_foods_by_category(category: str):
-    return list_foods_by_category(category)
+def cached_list_foods_by_category(category: str, ver: int):
+    return db.list_foods_by_category(category)
 
 @st.cache_data(ttl=15, show_spinner=False)
-def cached_list_entries_by_date(date_str: str, user_id: str):
-    return list_entries_by_date(date_str, user_id)
+def cached_list_entries_by_date(date_str: str, user_id: str, ver: int):
+    return db.list_entries_by_date(date_str, user_id)
 
 @st.cache_data(ttl=30, show_spinner=False)
-def cached_daily_totals_last_days(days: int, user_id: str):
-    return daily_totals_last_days(days, user_id=user_id)
+def cached_daily_totals_last_days(days: int, user_id: str, ver: int):
+    return db.daily_totals_last_days(days, user_id=user_id)
 
 
 # =========================
@@ -853,6 +860,11 @@ require_login()
 
 uid = st.session_state["user_id"]
 
+init_storage()
+
+# ✅ Carga en frío: foods + entries + settings en una sola llamada a Sheets
+db.bootstrap_caches()
+
 # =========================
 # SESSION UI STATE (fecha + dialogs)
 # =========================
@@ -1167,10 +1179,16 @@ if page == "📊 Dashboard":
 
     # --- Objetivos (ANTES del hero, para poder mostrarlos arriba) ---
     uid = st.session_state["user_id"]
-    target_kcal = float(get_setting("target_deficit_calories", 1800, user_id=uid))
-    target_p = float(get_setting("target_protein", 120, user_id=uid))
-    target_c = float(get_setting("target_carbs", 250, user_id=uid))
-    target_f = float(get_setting("target_fat", 60, user_id=uid))
+    targets = db.get_settings_many({
+        "target_deficit_calories": 1800.0,
+        "target_protein": 120.0,
+        "target_carbs": 250.0,
+        "target_fat": 60.0,
+    }, user_id=uid)
+    target_kcal = targets["target_deficit_calories"]
+    target_p = targets["target_protein"]
+    target_c = targets["target_carbs"]
+    target_f = targets["target_fat"]
 
     # --- Hero (cabecera móvil pro) ---
     hero_html = textwrap.dedent(f"""
@@ -1191,12 +1209,13 @@ if page == "📊 Dashboard":
     # Acciones rápidas (móvil-friendly)
 
     # --- Datos del día ---
-    rows = cached_list_entries_by_date(selected_date_str, st.session_state["user_id"])
+    rows = cached_list_entries_by_date(selected_date_str, st.session_state["user_id"], db.data_version(TAB_ENTRIES, st.session_state["user_id"]))
 
-    total_kcal = sum(float(r["calories"]) for r in rows) if rows else 0.0
-    total_protein = sum(float(r["protein"]) for r in rows) if rows else 0.0
-    total_carbs = sum(float(r["carbs"]) for r in rows) if rows else 0.0
-    total_fat = sum(float(r["fat"]) for r in rows) if rows else 0.0
+    day_tot = pd.DataFrame(rows, columns=["calories", "protein", "carbs", "fat"]).astype(float).sum()
+    total_kcal = float(day_tot["calories"])
+    total_protein = float(day_tot["protein"])
+    total_carbs = float(day_tot["carbs"])
+    total_fat = float(day_tot["fat"])
 
     # --- CSS SOLO para el iframe (dashboard) ---
     DASH_CSS = """
@@ -1460,7 +1479,7 @@ if page == "📊 Dashboard":
     components.html(progreso_html, height=550, scrolling=False)
 
     # ===== HISTÓRICO =====
-    hist = cached_daily_totals_last_days(30, user_id=uid)
+    hist = cached_daily_totals_last_days(30, user_id=uid, ver=db.data_version(TAB_ENTRIES, uid))
     hist_df = pd.DataFrame(hist, columns=["date", "calories", "protein", "carbs", "fat"])
 
     # ===== CHART: Últimos 30 días =====
@@ -1560,41 +1579,54 @@ elif page == "🍽 Registro":
     # -------------------------
     # DEBUG (lo dejas igual)
     # -------------------------
-    with st.expander("🛠️ DEBUG Sheets (solo para ti)", expanded=False):
-        import db_gsheets
-        try:
-            sh = db_gsheets._sh()
-            ws = db_gsheets._ws(db_gsheets.TAB_ENTRIES)
+    if backend_name() == "sheets":
+        with st.expander("🛠️ DEBUG Sheets (solo para ti)", expanded=False):
+            import db_gsheets
+            try:
+                sh = db_gsheets._sh()
+                ws = db_gsheets._ws(db_gsheets.TAB_ENTRIES)
 
-            st.write("**Sheet ID (secrets):**", db_gsheets.SHEET_ID)
-            st.write("**Spreadsheet title:**", sh.title)
-            st.write("**Worksheet title:**", ws.title)
-            st.write("**Worksheets disponibles:**", [w.title for w in sh.worksheets()])
+                st.write("**Sheet ID (secrets):**", db_gsheets.SHEET_ID)
+                st.write("**Spreadsheet title:**", sh.title)
+                st.write("**Worksheet title:**", ws.title)
+                st.write("**Worksheets disponibles:**", [w.title for w in sh.worksheets()])
 
-            header = ws.row_values(1)
-            st.write("**Header entries:**", header)
+                header = ws.row_values(1)
+                st.write("**Header entries:**", header)
 
-            all_vals = ws.get_all_values()
-            st.write("**Filas totales (get_all_values):**", len(all_vals))
+                all_vals = ws.get_all_values()
+                st.write("**Filas totales (get_all_values):**", len(all_vals))
 
-            if len(all_vals) >= 2:
-                st.write("**Última fila:**", all_vals[-1])
-            else:
-                st.write("**Última fila:** (vacío, solo headers)")
+                if len(all_vals) >= 2:
+                    st.write("**Última fila:**", all_vals[-1])
+                else:
+                    st.write("**Última fila:** (vacío, solo headers)")
+
+                st.write("**Rate limiter (Sheets):**", db_gsheets.rate_limiter_stats())
+                st.write("**Escrituras pendientes (journal):**", db_gsheets.pending_writes())
+                failed = db_gsheets.failed_writes()
+                if failed:
+                    st.warning(f"{len(failed)} escrituras fallidas (agotaron los reintentos):")
+                    st.dataframe(pd.DataFrame(failed), use_container_width=True)
+                if db_gsheets.ARCHIVE_HORIZON_DAYS > 0:
+                    status = db_gsheets.archive_status()
+                    st.write("**Archivado:**", status)
+                    if status["last_error"]:
+                        st.error(f"El último archivado falló: {status['last_error']}")
 
-        except Exception as e:
-            st.error("Fallo leyendo debug de Sheets")
-            st.exception(e)
+            except Exception as e:
+                st.error("Fallo leyendo debug de Sheets")
+                st.exception(e)
 
     # -------------------------
     # Datos base
     # -------------------------
-    categories = cached_list_categories()
+    categories = cached_list_categories(db.data_version(TAB_FOODS))
     if not categories:
         st.error("No hay categorías. Revisa la pestaña foods.")
         st.stop()
     
-    all_foods = cached_list_all_foods()
+    all_foods = cached_list_all_foods(db.data_version(TAB_FOODS))
     
     food_map = {}
     food_by_id = {}
@@ -1621,7 +1653,7 @@ elif page == "🍽 Registro":
     with colA:
         category = st.selectbox("Categoría", categories, key="reg_category_cart")
     with colB:
-        foods_in_cat = cached_list_foods_by_category(category)
+        foods_in_cat = cached_list_foods_by_category(category, db.data_version(TAB_FOODS))
         if not foods_in_cat:
             st.warning("Esa categoría no tiene alimentos.")
             st.stop()
@@ -1728,7 +1760,7 @@ elif page == "🍽 Registro":
 
     if commit and st.session_state["pending_entries"]:
         try:
-            new_ids = []
+            batch = []
             for it in st.session_state["pending_entries"]:
                 nm = str(it.get("name", "")).strip()
                 gr = float(it.get("grams", 0) or 0)
@@ -1757,10 +1789,11 @@ elif page == "🍽 Registro":
                     "fat": float(it.get("fat", 0.0)),
                 }
 
-                new_id = add_entry(entry)
-                new_ids.append(new_id)
+                batch.append(entry)
+
+            # ✅ Un solo append_rows para todo el carrito
+            new_ids = db.add_entries(batch)
     
-            st.cache_data.clear()
     
             # feedback
             st.session_state["_just_added"] = True
@@ -1815,7 +1848,7 @@ elif page == "🍽 Registro":
     # REGISTRO DEL DÍA (TU TABLA ACTUAL: intacta)
     # ======================================================
     st.subheader("Registro")
-    rows = cached_list_entries_by_date(selected_date_str, st.session_state["user_id"])
+    rows = cached_list_entries_by_date(selected_date_str, st.session_state["user_id"], db.data_version(TAB_ENTRIES, st.session_state["user_id"]))
     df = pd.DataFrame(rows, columns=["id", "meal", "name", "grams", "calories", "protein", "carbs", "fat"])
 
     if df.empty:
@@ -1871,13 +1904,20 @@ elif page == "🍽 Registro":
         with c4:
             st.metric("🥑 Grasas", f"{df['fat'].sum():.1f} g")
 
-        if not df.empty:
+        # Las entradas archivadas (backend Sheets) son de solo lectura: no se ofrecen para editar/borrar
+        archived_ids = {int(r["id"]) for r in rows if r.get("archived")}
+        df_edit = df[~df["id"].astype(int).isin(archived_ids)]
+
+        if archived_ids:
+            st.caption("📦 Este día incluye entradas archivadas: son de solo lectura.")
+
+        if not df_edit.empty:
             st.subheader("✏️ Editar / 🗑️ Borrar entrada")
 
             options = [{
                 "id": int(r["id"]),
                 "label": f"{r['meal']} — {r['name']} — {float(r['grams']):.0f} g"
-            } for _, r in df.iterrows()]
+            } for _, r in df_edit.iterrows()]
 
             selected_opt = st.selectbox(
                 "Selecciona una entrada",
@@ -1887,7 +1927,7 @@ elif page == "🍽 Registro":
             )
 
             selected_id = int(selected_opt["id"])
-            sel_df = df[df["id"] == selected_id]
+            sel_df = df_edit[df_edit["id"] == selected_id]
             
             # ✅ Si el id ya no existe (porque lo acabas de borrar), no crashear
             if sel_df.empty:
@@ -1926,7 +1966,7 @@ elif page == "🍽 Registro":
             else:
                 if st.button("Guardar cambios", type="primary", key=f"save_entry_{selected_id}"):
                     macros = scale_macros(base_food, float(new_grams))
-                    update_entry(
+                    db.update_entry(
                         selected_id,
                         grams=float(new_grams),
                         calories=float(macros["calories"]),
@@ -1935,19 +1975,17 @@ elif page == "🍽 Registro":
                         fat=float(macros["fat"]),
                         meal=new_meal
                     )
-                    st.cache_data.clear()
                     st.success("Entrada actualizada ✅")
                     st.rerun()
             
                 st.warning("⚠️ Borrar elimina la entrada (no se puede deshacer).")
                 confirm_del = st.checkbox("Confirmo que quiero borrar esta entrada", key=f"confirm_del_{selected_id}")
                 if st.button("Borrar entrada", disabled=not confirm_del, key=f"del_entry_{selected_id}"):
-                    delete_entry_by_id(selected_id)
+                    db.delete_entry_by_id(selected_id)
                 
                     # ✅ limpiar selector para que no apunte a un id borrado
                     st.session_state.pop("entry_select_edit", None)
                 
-                    st.cache_data.clear()
                     st.success("Entrada borrada ✅")
                     st.rerun()
 
@@ -1958,16 +1996,26 @@ elif page == "🍽 Registro":
 elif page == "🎯 Objetivos":
     uid = st.session_state["user_id"]
 
-    saved_sex = str(get_setting("sex", "M", user_id=uid)).upper().strip()
-    saved_age = float(get_setting("age", 25, user_id=uid))
-    saved_weight = float(get_setting("weight", 70, user_id=uid))
-    saved_height = float(get_setting("height", 175, user_id=uid))
-    saved_activity = float(get_setting("activity", 1.55, user_id=uid))
-    saved_deficit = float(get_setting("deficit_pct", 20, user_id=uid))
+    saved_settings = db.get_settings_many({
+        "sex": "M",
+        "age": 25.0,
+        "weight": 70.0,
+        "height": 175.0,
+        "activity": 1.55,
+        "deficit_pct": 20.0,
+        "body_metrics_json": "{}",
+    }, user_id=uid)
+
+    saved_sex = str(saved_settings["sex"]).upper().strip()
+    saved_age = saved_settings["age"]
+    saved_weight = saved_settings["weight"]
+    saved_height = saved_settings["height"]
+    saved_activity = saved_settings["activity"]
+    saved_deficit = saved_settings["deficit_pct"]
 
     # --- Medidas corporales guardadas (opcional) ---
     # --- Medidas corporales guardadas (desde JSON) ---
-    raw_bm = get_setting("body_metrics_json", "{}", user_id=uid)
+    raw_bm = saved_settings["body_metrics_json"]
     try:
         bm = json.loads(raw_bm) if raw_bm else {}
     except Exception:
@@ -2200,18 +2248,21 @@ elif page == "🎯 Objetivos":
             deficit_pct=float(deficit_pct),
         )
 
-        set_setting("sex", str(sex), user_id=uid)
-        set_setting("age", str(age), user_id=uid)
-        set_setting("weight", str(weight), user_id=uid)
-        set_setting("height", str(height), user_id=uid)
-        set_setting("activity", str(activity), user_id=uid)
-        set_setting("deficit_pct", str(deficit_pct), user_id=uid)
-
-        set_setting("target_maintenance", str(maintenance), user_id=uid)
-        set_setting("target_deficit_calories", str(deficit_kcal), user_id=uid)
-        set_setting("target_protein", str(protein_g), user_id=uid)
-        set_setting("target_carbs", str(carbs_g), user_id=uid)
-        set_setting("target_fat", str(fat_g), user_id=uid)
+        # Se guardan todas juntas al final (set_settings = 1 batch_update/append_rows)
+        profile_settings = {
+            "sex": str(sex),
+            "age": str(age),
+            "weight": str(weight),
+            "height": str(height),
+            "activity": str(activity),
+            "deficit_pct": str(deficit_pct),
+
+            "target_maintenance": str(maintenance),
+            "target_deficit_calories": str(deficit_kcal),
+            "target_protein": str(protein_g),
+            "target_carbs": str(carbs_g),
+            "target_fat": str(fat_g),
+        }
 
         
         # =========================
@@ -2288,21 +2339,28 @@ elif page == "🎯 Objetivos":
             }
         }
 
-        # ✅ UNA sola llamada a Google Sheets
-        set_setting("body_metrics_json", json.dumps(body_metrics, ensure_ascii=False), user_id=uid)
+        # ✅ UNA sola escritura a Google Sheets para todo el perfil
+        profile_settings["body_metrics_json"] = json.dumps(body_metrics, ensure_ascii=False)
+        db.set_settings(profile_settings, user_id=uid)
 
         
-        st.cache_data.clear()
         st.success("Perfil y objetivos guardados ✅")
         st.rerun()
 
     st.divider()
 
-    target_maint = get_setting("target_maintenance", user_id=uid)
-    target_def = get_setting("target_deficit_calories", user_id=uid)
-    target_p = get_setting("target_protein", user_id=uid)
-    target_c = get_setting("target_carbs", user_id=uid)
-    target_f = get_setting("target_fat", user_id=uid)
+    saved_targets = db.get_settings_many([
+        "target_maintenance",
+        "target_deficit_calories",
+        "target_protein",
+        "target_carbs",
+        "target_fat",
+    ], user_id=uid)
+    target_maint = saved_targets["target_maintenance"]
+    target_def = saved_targets["target_deficit_calories"]
+    target_p = saved_targets["target_protein"]
+    target_c = saved_targets["target_carbs"]
+    target_f = saved_targets["target_fat"]
 
     if all([target_maint, target_def, target_p, target_c, target_f]):
         st.subheader("📌 Tus objetivos guardados")
@@ -2338,7 +2396,7 @@ elif page == "➕ Añadir alimento":
         "🍽️ Platos ya hechos",
     ]
             
-    all_foods = list_all_foods()
+    all_foods = db.list_all_foods()
 
     if mode == "➕ Añadir":
         with st.form("add_food_form", clear_on_submit=False):
@@ -2366,7 +2424,7 @@ elif page == "➕ Añadir alimento":
                     elif not nc:
                         st.error("Falta la categoría.")
                     else:
-                        add_food({
+                        db.add_food({
                             "name": nn,
                             "category": nc,
                             "calories": float(calories),
@@ -2374,7 +2432,6 @@ elif page == "➕ Añadir alimento":
                             "carbs": float(carbs),
                             "fat": float(fat),
                         })
-                        st.cache_data.clear()
                         st.success("Alimento guardado ✅")
                         st.rerun()
                 except Exception as e:
@@ -2409,7 +2466,7 @@ elif page == "➕ Añadir alimento":
                 elif not nc:
                     st.error("La categoría no puede estar vacía.")
                 else:
-                    update_food(selected["id"], {
+                    db.update_food(selected["id"], {
                         "name": nn,
                         "category": nc,
                         "calories": float(new_calories),
@@ -2417,7 +2474,6 @@ elif page == "➕ Añadir alimento":
                         "carbs": float(new_carbs),
                         "fat": float(new_fat),
                     })
-                    st.cache_data.clear()
                     st.success("Cambios guardados ✅")
                     st.rerun()
 
@@ -2433,8 +2489,7 @@ elif page == "➕ Añadir alimento":
             st.warning("⚠️ Esto lo borra de la base de datos. No se puede deshacer.")
             confirm = st.checkbox(f"Confirmo que quiero borrar: {selected['name']}")
             if st.button("Borrar alimento", disabled=not confirm):
-                delete_food_by_id(selected["id"])
-                st.cache_data.clear()
+                db.delete_food_by_id(selected["id"])
                 st.success("Alimento borrado ✅")
                 st.rerun()
 
@@ -2499,10 +2554,10 @@ elif page == "👨‍🍳 Chef IA":
 
     st.divider()
 
-    cats = list_categories()
+    cats = db.list_categories()
     food_map = {}
     for c in cats:
-        for f in list_foods_by_category(c):
+        for f in db.list_foods_by_category(c):
             food_map[f["name"]] = f
     allowed = list(food_map.keys())
 
@@ -2516,10 +2571,16 @@ elif page == "👨‍🍳 Chef IA":
             st.info("No hay alimentos disponibles en tu base de datos.")
             st.stop()
 
-        target_def = float(get_setting("target_deficit_calories", 2000, user_id=uid))
-        target_p = float(get_setting("target_protein", 120, user_id=uid))
-        target_c = float(get_setting("target_carbs", 250, user_id=uid))
-        target_f = float(get_setting("target_fat", 60, user_id=uid))
+        targets = db.get_settings_many({
+            "target_deficit_calories": 2000.0,
+            "target_protein": 120.0,
+            "target_carbs": 250.0,
+            "target_fat": 60.0,
+        }, user_id=uid)
+        target_def = targets["target_deficit_calories"]
+        target_p = targets["target_protein"]
+        target_c = targets["target_carbs"]
+        target_f = targets["target_fat"]
 
         kcal_obj = st.number_input("Objetivo kcal (día)", min_value=800.0, max_value=6000.0, value=target_def, step=50.0, key="menu_kcal")
         prot_obj = st.number_input("Proteína objetivo (g)", min_value=0.0, max_value=400.0, value=target_p, step=5.0, key="menu_p")
@@ -2790,7 +2851,7 @@ elif page == "👨‍🍳 Chef IA":
                 elif total_grams <= 0:
                     st.error("El plato debe tener gramos totales > 0.")
                 else:
-                    add_food({
+                    db.add_food({
                         "name": nn,
                         "category": nc,
                         "calories": float(per100["calories"]),
@@ -2798,7 +2859,6 @@ elif page == "👨‍🍳 Chef IA":
                         "carbs": float(per100["carbs"]),
                         "fat": float(per100["fat"]),
                     })
-                    st.cache_data.clear()
                     st.success("Plato guardado como alimento ✅")
 
                     st.session_state["dish_items"] = [{"name": allowed[0], "grams": 100.0}]
@@ -2821,18 +2881,28 @@ elif page == "🏋️ Rutina IA":
 
     uid = st.session_state["user_id"]
 
+    # --- Todas las settings de la página en un solo lookup ---
+    wk_settings = db.get_settings_many({
+        "workout_profile_json": "{}",
+        "workout_plan_json": "",
+        "target_deficit_calories": 1800.0,
+        "target_protein": 120.0,
+        "target_carbs": 250.0,
+        "target_fat": 60.0,
+    }, user_id=uid)
+
     # --- Cargar perfil guardado (si existe) ---
-    saved_profile_raw = get_setting("workout_profile_json", default="{}", user_id=uid)
+    saved_profile_raw = wk_settings["workout_profile_json"]
     try:
         saved_profile = json.loads(saved_profile_raw) if saved_profile_raw else {}
     except Exception:
         saved_profile = {}
 
     # --- Objetivos nutrición (de tu app) ---
-    target_kcal = float(get_setting("target_deficit_calories", 1800, user_id=uid))
-    target_p = float(get_setting("target_protein", 120, user_id=uid))
-    target_c = float(get_setting("target_carbs", 250, user_id=uid))
-    target_f = float(get_setting("target_fat", 60, user_id=uid))
+    target_kcal = wk_settings["target_deficit_calories"]
+    target_p = wk_settings["target_protein"]
+    target_c = wk_settings["target_carbs"]
+    target_f = wk_settings["target_fat"]
 
     # ======================================================
     # Cargar rutina (para saber si hay plan y poder hacer 2 columnas)
@@ -2840,7 +2910,7 @@ elif page == "🏋️ Rutina IA":
     # ======================================================
     # Cargar rutina guardada (PRIORIDAD) y fallback a session_state
     # ======================================================
-    saved_plan_raw = get_setting("workout_plan_json", default="", user_id=uid)
+    saved_plan_raw = wk_settings["workout_plan_json"]
     
     plan = None
     
@@ -3319,12 +3389,12 @@ elif page == "🏋️ Rutina IA":
                         "focus": focus.strip(),
                         "limitations": limitations.strip(),
                     }
-                    set_setting("workout_profile_json", json.dumps(profile, ensure_ascii=False), user_id=uid)
+                    db.set_setting("workout_profile_json", json.dumps(profile, ensure_ascii=False), user_id=uid)
                     st.success("Perfil guardado ✅")
                     st.rerun()
             with colS2:
                 if st.button("🧹 Reset perfil", use_container_width=True, key="wk_reset_profile"):
-                    set_setting("workout_profile_json", "{}", user_id=uid)
+                    db.set_setting("workout_profile_json", "{}", user_id=uid)
                     st.success("Perfil reseteado ✅")
                     st.rerun()
 
@@ -3429,14 +3499,11 @@ elif page == "🏋️ Rutina IA":
                 if st.button("💾", key="wk_save_plan_icon", help="Guardar rutina"):
                     try:
                         # guarda en Sheets
-                        set_setting("workout_plan_json", json.dumps(plan, ensure_ascii=False), user_id=uid)
+                        db.set_setting("workout_plan_json", json.dumps(plan, ensure_ascii=False), user_id=uid)
                 
                         # ✅ deja también copia local por si acaso
                         st.session_state["last_workout_plan"] = plan
                 
-                        # ✅ por si hay caches por TTL en tu app/db
-                        st.cache_data.clear()
-                
                         st.toast("Rutina guardada ✅")
                         st.rerun()
                     except Exception as e:
@@ -3445,9 +3512,8 @@ elif page == "🏋️ Rutina IA":
 
                 if st.button("🗑️", key="wk_delete_plan_icon", help="Borrar rutina guardada"):
                     try:
-                        set_setting("workout_plan_json", "", user_id=uid)
+                        db.set_setting("workout_plan_json", "", user_id=uid)
                         st.session_state.pop("last_workout_plan", None)
-                        st.cache_data.clear()
                         st.toast("Rutina borrada ✅")
                         st.rerun()
                     except Exception as e:
@@ -3737,7 +3803,7 @@ elif page == "🤖 IA Alimento":
             if not final_name:
                 st.error("Pon un nombre válido.")
             else:
-                add_food({
+                db.add_food({
                     "name": final_name,
                     "category": final_cat,
                     "calories": float(macros.get("calories", 0.0)),
@@ -3745,7 +3811,6 @@ elif page == "🤖 IA Alimento":
                     "carbs": float(macros.get("carbs", 0.0)),
                     "fat": float(macros.get("fat", 0.0)),
                 })
-                st.cache_data.clear()
                 st.success("Alimento añadido ✅")
 
                 # opcional: limpiar estado para nueva búsqueda
@@ -0,0 +1,58 @@
+# archive.py
+"""
+Archivo frío local de entries en Parquet comprimido (ARCHIVE_TARGET = "parquet").
+
+Un fichero por año (archive/entries_YYYY.parquet) con las filas A..J de entries
+y un manifest (archive/manifest.parquet) con los agregados por (usuario, día),
+mismo formato de fila que la pestaña daily_totals.
+db_gsheets usa este módulo igual que su archivo en pestañas (mismas funciones).
+Necesita pyarrow instalado (solo si se elige este destino).
+"""
+import os
+
+import pandas as pd
+
+ARCHIVE_DIR = "archive"
+
+ENTRY_COLS = ["id", "user_id", "entry_date", "meal", "name", "grams", "calories", "protein", "carbs", "fat"]
+MANIFEST_COLS = ["key", "user_id", "entry_date", "calories", "protein", "carbs", "fat", "n_entries"]
+
+
+def _path(name: str) -> str:
+    return os.path.join(ARCHIVE_DIR, f"{name}.parquet")
+
+
+def _read(name: str, cols: list[str]) -> pd.DataFrame:
+    p = _path(name)
+    if not os.path.exists(p):
+        return pd.DataFrame(columns=cols)
+    return pd.read_parquet(p)
+
+
+def _write(name: str, df: pd.DataFrame) -> None:
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    tmp = _path(name) + ".tmp"
+    df.to_parquet(tmp, compression="zstd", index=False)
+    os.replace(tmp, _path(name))  # atómico: nunca queda un fichero a medias
+
+
+def append_rows(year: int, rows: list[list]) -> int:
+    """Añade filas al año (sin duplicar IDs ya archivados). Devuelve cuántas eran nuevas."""
+    cur = _read(f"entries_{year}", ENTRY_COLS)
+    new = pd.DataFrame([list(r) for r in rows], columns=ENTRY_COLS)
+    new = new[~new["id"].isin(cur["id"])]
+    if len(new):
+        _write(f"entries_{year}", pd.concat([cur, new], ignore_index=True).astype({"id": "int64"}))
+    return len(new)
+
+
+def read_rows(year: int) -> list[list]:
+    return _read(f"entries_{year}", ENTRY_COLS)[ENTRY_COLS].values.tolist()
+
+
+def read_manifest() -> list[list]:
+    return _read("manifest", MANIFEST_COLS)[MANIFEST_COLS].values.tolist()
+
+
+def write_manifest(rows: list[list]) -> None:
+    _write("manifest", pd.DataFrame([list(r) for r in rows], columns=MANIFEST_COLS))
@@ -1,58 +1,247 @@
 # db.py
+import datetime as dt
 import sqlite3
+import threading
+
+from storage import DataVersions, TAB_ENTRIES, TAB_FOODS, TAB_SETTINGS, cast_setting, scoped_setting_key
 
 DB_PATH = "calorie_app.db"
 
+FOOD_COLS = ["id", "name", "category", "calories", "protein", "carbs", "fat"]
+ENTRY_COLS = ["id", "user_id", "entry_date", "meal", "name", "grams", "calories", "protein", "carbs", "fat"]
+
+_VERSIONS = DataVersions()
+
+# Una conexión por hilo (Streamlit atiende cada sesión en su hilo) reutilizada
+# entre llamadas, en vez de abrir una nueva en cada función.
+_LOCAL = threading.local()
+
+# Ajustes por conexión. WAL (en init_db) deja leer mientras otra sesión escribe;
+# synchronous=NORMAL es seguro con WAL y evita un fsync por commit.
+PRAGMAS = [
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+]
+
 def get_conn():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+    cached = getattr(_LOCAL, "conn", None)
+    if cached is not None and cached[0] == DB_PATH:
+        return cached[1]
 
-def init_db():
-    with get_conn() as conn:
-        cur = conn.cursor()
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    _LOCAL.conn = (DB_PATH, conn)
+    return conn
 
-        # Alimentos
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS foods (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                category TEXT NOT NULL,
-                calories REAL NOT NULL,
-                protein REAL NOT NULL,
-                carbs REAL NOT NULL,
-                fat REAL NOT NULL
-            )
-        """)
+def _columns(cur, table: str) -> set:
+    cur.execute(f"PRAGMA table_info({table})")
+    return {r[1] for r in cur.fetchall()}
 
-        # Entradas por día
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS entries (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                entry_date TEXT NOT NULL,
-                meal TEXT NOT NULL,
-                name TEXT NOT NULL,
-                grams REAL NOT NULL,
-                calories REAL NOT NULL,
-                protein REAL NOT NULL,
-                carbs REAL NOT NULL,
-                fat REAL NOT NULL
-            )
-        """)
+# ---------- Migraciones de esquema ----------
+# PRAGMA user_version guarda cuántas se han aplicado; cada una corre una sola vez,
+# en orden y en su propia transacción. Solo se añaden al final, nunca se editan.
+def _m001_base(cur):
+    # Alimentos
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS foods (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            category TEXT NOT NULL,
+            calories REAL NOT NULL,
+            protein REAL NOT NULL,
+            carbs REAL NOT NULL,
+            fat REAL NOT NULL
+        )
+    """)
 
-        # Ajustes/objetivos
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT NOT NULL
-            )
-        """)
+    # Entradas por día
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            entry_date TEXT NOT NULL,
+            meal TEXT NOT NULL,
+            name TEXT NOT NULL,
+            grams REAL NOT NULL,
+            calories REAL NOT NULL,
+            protein REAL NOT NULL,
+            carbs REAL NOT NULL,
+            fat REAL NOT NULL
+        )
+    """)
+
+    # Ajustes/objetivos
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+
+def _m002_entry_date(cur):
+    # Por si venías de tabla vieja sin entry_date
+    if "entry_date" not in _columns(cur, "entries"):
+        cur.execute("ALTER TABLE entries ADD COLUMN entry_date TEXT")
+
+def _m003_user_id(cur):
+    # Entradas por usuario (las antiguas quedan con user_id '')
+    if "user_id" not in _columns(cur, "entries"):
+        cur.execute("ALTER TABLE entries ADD COLUMN user_id TEXT NOT NULL DEFAULT ''")
+
+def _m004_indexes(cur):
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_entries_user_date ON entries(user_id, entry_date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_entries_date ON entries(entry_date)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_foods_category ON foods(category, name)")
+
+# Totales diarios materializados: una fila por (usuario, día), mantenida por
+# triggers sobre entries. El histórico lee como mucho `days` filas precalculadas
+# en vez de agrupar todas las entradas del rango.
+DAILY_TOTALS_BACKFILL = """
+    INSERT INTO daily_totals (user_id, entry_date, calories, protein, carbs, fat, n_entries)
+    SELECT user_id, entry_date, SUM(calories), SUM(protein), SUM(carbs), SUM(fat), COUNT(*)
+    FROM entries
+    WHERE entry_date IS NOT NULL
+    GROUP BY user_id, entry_date
+"""
+
+def _create_daily_totals_triggers(cur):
+    # Las filas legacy (ver _m002_entry_date) pueden tener entry_date NULL: no
+    # cuentan para ningún día, así que los triggers las ignoran.
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_entries_ai AFTER INSERT ON entries
+        WHEN NEW.entry_date IS NOT NULL
+        BEGIN
+            INSERT INTO daily_totals (user_id, entry_date, calories, protein, carbs, fat, n_entries)
+            VALUES (NEW.user_id, NEW.entry_date, NEW.calories, NEW.protein, NEW.carbs, NEW.fat, 1)
+            ON CONFLICT (user_id, entry_date) DO UPDATE SET
+                calories = calories + excluded.calories,
+                protein = protein + excluded.protein,
+                carbs = carbs + excluded.carbs,
+                fat = fat + excluded.fat,
+                n_entries = n_entries + 1;
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_entries_ad AFTER DELETE ON entries
+        WHEN OLD.entry_date IS NOT NULL
+        BEGIN
+            UPDATE daily_totals SET
+                calories = calories - OLD.calories,
+                protein = protein - OLD.protein,
+                carbs = carbs - OLD.carbs,
+                fat = fat - OLD.fat,
+                n_entries = n_entries - 1
+            WHERE user_id = OLD.user_id AND entry_date = OLD.entry_date;
+            DELETE FROM daily_totals
+            WHERE user_id = OLD.user_id AND entry_date = OLD.entry_date AND n_entries <= 0;
+        END
+    """)
+    # Un UPDATE puede pasar de NULL a fecha o al revés: cada mitad va con su guarda
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_entries_au
+        AFTER UPDATE OF user_id, entry_date, calories, protein, carbs, fat ON entries
+        BEGIN
+            UPDATE daily_totals SET
+                calories = calories - OLD.calories,
+                protein = protein - OLD.protein,
+                carbs = carbs - OLD.carbs,
+                fat = fat - OLD.fat,
+                n_entries = n_entries - 1
+            WHERE OLD.entry_date IS NOT NULL
+              AND user_id = OLD.user_id AND entry_date = OLD.entry_date;
+            DELETE FROM daily_totals
+            WHERE OLD.entry_date IS NOT NULL
+              AND user_id = OLD.user_id AND entry_date = OLD.entry_date AND n_entries <= 0;
+            INSERT INTO daily_totals (user_id, entry_date, calories, protein, carbs, fat, n_entries)
+            SELECT NEW.user_id, NEW.entry_date, NEW.calories, NEW.protein, NEW.carbs, NEW.fat, 1
+            WHERE NEW.entry_date IS NOT NULL
+            ON CONFLICT (user_id, entry_date) DO UPDATE SET
+                calories = calories + excluded.calories,
+                protein = protein + excluded.protein,
+                carbs = carbs + excluded.carbs,
+                fat = fat + excluded.fat,
+                n_entries = n_entries + 1;
+        END
+    """)
+
+def _m005_daily_totals(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            user_id TEXT NOT NULL,
+            entry_date TEXT NOT NULL,
+            calories REAL NOT NULL,
+            protein REAL NOT NULL,
+            carbs REAL NOT NULL,
+            fat REAL NOT NULL,
+            n_entries INTEGER NOT NULL,
+            PRIMARY KEY (user_id, entry_date)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_daily_totals_date ON daily_totals(entry_date)")
+
+    _create_daily_totals_triggers(cur)
+
+    cur.execute("DELETE FROM daily_totals")
+    cur.execute(DAILY_TOTALS_BACKFILL)
+
+def _m006_daily_totals_null_guard(cur):
+    # Las bases que ya aplicaron _m005 tienen los triggers sin la guarda de
+    # entry_date NULL: se recrean y se recalcula por si alguna fila NULL entró
+    for trigger in ("trg_entries_ai", "trg_entries_ad", "trg_entries_au"):
+        cur.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    _create_daily_totals_triggers(cur)
+    cur.execute("DELETE FROM daily_totals")
+    cur.execute(DAILY_TOTALS_BACKFILL)
+
+MIGRATIONS = [
+    _m001_base,
+    _m002_entry_date,
+    _m003_user_id,
+    _m004_indexes,
+    _m005_daily_totals,
+    _m006_daily_totals_null_guard,
+]
+
+def rebuild_daily_totals():
+    """Recalcula daily_totals desde entries (reparación manual; los triggers lo mantienen al día)."""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM daily_totals")
+        cur.execute(DAILY_TOTALS_BACKFILL)
         conn.commit()
 
-        # Migración por si venías de tabla vieja sin entry_date
+def schema_version() -> int:
+    return get_conn().execute("PRAGMA user_version").fetchone()[0]
+
+def init_db():
+    conn = get_conn()
+    conn.execute("PRAGMA journal_mode = WAL")
+
+    cur = conn.cursor()
+    while True:
+        # BEGIN IMMEDIATE: si dos procesos arrancan a la vez, solo uno migra
+        cur.execute("BEGIN IMMEDIATE")
+        version = cur.execute("PRAGMA user_version").fetchone()[0]
+        if version >= len(MIGRATIONS):
+            conn.rollback()
+            break
         try:
-            cur.execute("ALTER TABLE entries ADD COLUMN entry_date TEXT")
+            MIGRATIONS[version](cur)
+            cur.execute(f"PRAGMA user_version = {version + 1}")
             conn.commit()
-        except sqlite3.OperationalError:
-            pass
+        except Exception:
+            conn.rollback()
+            raise
+
+def bootstrap_caches():
+    """Nada que precargar: las lecturas ya son locales."""
+    return None
+
+def data_version(tab_name: str, user_id: str | None = None) -> int:
+    return _VERSIONS.get(tab_name, user_id)
 
 def seed_foods_if_empty(default_foods: list[dict]):
     """Rellena foods solo si está vacío (primera ejecución)."""
@@ -69,6 +258,7 @@ def seed_foods_if_empty(default_foods: list[dict]):
                 for f in default_foods
             ])
             conn.commit()
+            _VERSIONS.bump(TAB_FOODS)
 
 def list_categories():
     with get_conn() as conn:
@@ -80,86 +270,152 @@ def list_foods_by_category(category: str):
     with get_conn() as conn:
         cur = conn.cursor()
         cur.execute("""
-            SELECT name, category, calories, protein, carbs, fat
+            SELECT id, name, category, calories, protein, carbs, fat
             FROM foods
             WHERE category = ?
             ORDER BY name
         """, (category,))
         rows = cur.fetchall()
-    return [
-        {"name": r[0], "category": r[1], "calories": r[2], "protein": r[3], "carbs": r[4], "fat": r[5]}
-        for r in rows
-    ]
+    return [dict(zip(FOOD_COLS, r)) for r in rows]
 
-def add_food(food: dict):
+def add_food(food: dict) -> int:
     with get_conn() as conn:
         cur = conn.cursor()
         cur.execute("""
             INSERT INTO foods (name, category, calories, protein, carbs, fat)
             VALUES (?, ?, ?, ?, ?, ?)
-        """, (food["name"], food["category"], food["calories"], food["protein"], food["carbs"], food["fat"]))
+        """, (
+            food["name"], food["category"], float(food.get("calories", 0) or 0),
+            float(food.get("protein", 0) or 0), float(food.get("carbs", 0) or 0), float(food.get("fat", 0) or 0)
+        ))
         conn.commit()
+        new_id = cur.lastrowid
+    _VERSIONS.bump(TAB_FOODS)
+    return new_id
 
 def delete_food_by_name(name: str):
     with get_conn() as conn:
         cur = conn.cursor()
         cur.execute("DELETE FROM foods WHERE name = ?", (name,))
         conn.commit()
+    _VERSIONS.bump(TAB_FOODS)
 
-def add_entry(entry: dict):
+def add_entries(entries: list[dict]) -> list[int]:
+    """Varias entradas en una sola transacción (carrito del Registro)."""
+    new_ids = []
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO entries (entry_date, meal, name, grams, calories, protein, carbs, fat)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            entry["entry_date"], entry["meal"], entry["name"], entry["grams"],
-            entry["calories"], entry["protein"], entry["carbs"], entry["fat"]
-        ))
+        for entry in entries:
+            cur.execute("""
+                INSERT INTO entries (user_id, entry_date, meal, name, grams, calories, protein, carbs, fat)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                str(entry.get("user_id", "")).strip(), entry["entry_date"], entry["meal"], entry["name"],
+                float(entry.get("grams", 0) or 0), float(entry.get("calories", 0) or 0),
+                float(entry.get("protein", 0) or 0), float(entry.get("carbs", 0) or 0), float(entry.get("fat", 0) or 0)
+            ))
+            new_ids.append(cur.lastrowid)
         conn.commit()
+    for uid in {str(e.get("user_id", "")).strip() for e in entries}:
+        _VERSIONS.bump(TAB_ENTRIES, user_id=uid)
+    return new_ids
+
+def add_entry(entry: dict) -> int:
+    return add_entries([entry])[0]
 
-def list_entries_by_date(entry_date: str):
+def list_entries_by_date(entry_date: str, user_id: str | None = None):
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("""
-            SELECT id, meal, name, grams, calories, protein, carbs, fat
-            FROM entries
-            WHERE entry_date = ?
-            ORDER BY id
-        """, (entry_date,))
-        return cur.fetchall()
-
-def daily_totals_last_days(days: int = 30):
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute(f"""
-            SELECT entry_date,
-                   SUM(calories) as calories,
-                   SUM(protein)  as protein,
-                   SUM(carbs)    as carbs,
-                   SUM(fat)      as fat
-            FROM entries
-            WHERE entry_date >= date('now', '-{int(days)} day')
-            GROUP BY entry_date
-            ORDER BY entry_date
-        """)
-        return cur.fetchall()
+        if user_id is None:
+            cur.execute("""
+                SELECT id, user_id, entry_date, meal, name, grams, calories, protein, carbs, fat
+                FROM entries
+                WHERE entry_date = ?
+                ORDER BY id
+            """, (entry_date,))
+        else:
+            cur.execute("""
+                SELECT id, user_id, entry_date, meal, name, grams, calories, protein, carbs, fat
+                FROM entries
+                WHERE user_id = ? AND entry_date = ?
+                ORDER BY id
+            """, (str(user_id).strip(), entry_date))
+        rows = cur.fetchall()
+    return [dict(zip(ENTRY_COLS, r)) for r in rows]
+
+def daily_totals_last_days(days: int = 30, user_id: str | None = None):
+    today = dt.date.today()
+    first = (today - dt.timedelta(days=int(days) - 1)).isoformat()
 
-def set_setting(key: str, value: str):
+    # Lee daily_totals (una fila por día), no las entradas
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("""
+        if user_id is None:
+            cur.execute("""
+                SELECT entry_date,
+                       SUM(calories) as calories,
+                       SUM(protein)  as protein,
+                       SUM(carbs)    as carbs,
+                       SUM(fat)      as fat
+                FROM daily_totals
+                WHERE entry_date BETWEEN ? AND ?
+                GROUP BY entry_date
+                ORDER BY entry_date
+            """, (first, today.isoformat()))
+        else:
+            cur.execute("""
+                SELECT entry_date, calories, protein, carbs, fat
+                FROM daily_totals
+                WHERE user_id = ? AND entry_date BETWEEN ? AND ?
+                ORDER BY entry_date
+            """, (str(user_id).strip(), first, today.isoformat()))
+        return [(d, float(kcal), float(p), float(c), float(f)) for d, kcal, p, c, f in cur.fetchall()]
+
+def set_settings(values: dict, user_id: str | None = None):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.executemany("""
             INSERT INTO settings (key, value) VALUES (?, ?)
             ON CONFLICT(key) DO UPDATE SET value = excluded.value
-        """, (key, value))
+        """, [(scoped_setting_key(k, user_id), str(v)) for k, v in values.items()])
         conn.commit()
+    _VERSIONS.bump(TAB_SETTINGS, user_id=user_id)
+
+def set_setting(key: str, value: str, user_id: str | None = None):
+    set_settings({key: value}, user_id=user_id)
+
+def get_settings_many(keys, user_id: str | None = None, fallback_global: bool = True) -> dict:
+    """
+    keys: lista de keys -> valores crudos (None si no existen)
+          dict {key: default} -> cada valor se convierte al tipo de su default
+    Por usuario si user_id != None (con fallback a la key global si fallback_global).
+    """
+    defaults = keys if isinstance(keys, dict) else dict.fromkeys(keys)
+    names = [str(k).strip() for k in defaults]
+    lookup = [scoped_setting_key(k, user_id) for k in names]
+    if user_id is not None and fallback_global:
+        lookup += names
 
-def get_setting(key: str, default: str | None = None):
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT value FROM settings WHERE key = ?", (key,))
-        row = cur.fetchone()
-    return row[0] if row else default
+        cur.execute(
+            f"SELECT key, value FROM settings WHERE key IN ({', '.join('?' * len(lookup))})",
+            lookup,
+        )
+        found = dict(cur.fetchall())
+
+    out = {}
+    for k, name in zip(defaults, names):
+        v = found.get(scoped_setting_key(name, user_id), "")
+        if v == "" and user_id is not None and fallback_global:
+            v = found.get(name, "")
+        out[k] = cast_setting(v, defaults[k])
+    return out
+
+def get_setting(key: str, default=None, user_id: str | None = None, fallback_global: bool = True):
+    v = get_settings_many([key], user_id=user_id, fallback_global=fallback_global)[key]
+    return v if v not in (None, "") else default
+
 def list_all_foods():
     with get_conn() as conn:
         cur = conn.cursor()
@@ -169,44 +425,57 @@ def list_all_foods():
             ORDER BY category, name
         """)
         rows = cur.fetchall()
-    return [
-        {"id": r[0], "name": r[1], "category": r[2], "calories": r[3], "protein": r[4], "carbs": r[5], "fat": r[6]}
-        for r in rows
-    ]
+    return [dict(zip(FOOD_COLS, r)) for r in rows]
 
 def update_food(food_id: int, updated: dict):
+    """Actualiza solo los campos presentes (no None)."""
+    cols = [c for c in FOOD_COLS[1:] if updated.get(c) is not None]
+    if not cols:
+        return
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("""
-            UPDATE foods
-            SET name = ?, category = ?, calories = ?, protein = ?, carbs = ?, fat = ?
-            WHERE id = ?
-        """, (
-            updated["name"], updated["category"], updated["calories"],
-            updated["protein"], updated["carbs"], updated["fat"],
-            food_id
-        ))
+        cur.execute(
+            f"UPDATE foods SET {', '.join(f'{c} = ?' for c in cols)} WHERE id = ?",
+            [updated[c] for c in cols] + [food_id],
+        )
         conn.commit()
+        if cur.rowcount == 0:
+            raise ValueError(f"No existe food id={food_id}")
+    _VERSIONS.bump(TAB_FOODS)
 
 def delete_food_by_id(food_id: int):
     with get_conn() as conn:
         cur = conn.cursor()
         cur.execute("DELETE FROM foods WHERE id = ?", (food_id,))
         conn.commit()
+    _VERSIONS.bump(TAB_FOODS)
 
-def update_entry(entry_id: int, grams: float, calories: float, protein: float, carbs: float, fat: float, meal: str):
+def _entry_owner(cur, entry_id: int):
+    cur.execute("SELECT user_id FROM entries WHERE id = ?", (entry_id,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def update_entry(entry_id: int, **updates):
+    """Actualiza solo los campos presentes (no None), como en Sheets."""
+    cols = [c for c in ENTRY_COLS[1:] if updates.get(c) is not None]
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute("""
-            UPDATE entries
-            SET grams = ?, calories = ?, protein = ?, carbs = ?, fat = ?, meal = ?
-            WHERE id = ?
-        """, (grams, calories, protein, carbs, fat, meal, entry_id))
-        conn.commit()
+        owner = _entry_owner(cur, entry_id)
+        if owner is None:
+            raise ValueError(f"No existe entry id={entry_id}")
+        if cols:
+            cur.execute(
+                f"UPDATE entries SET {', '.join(f'{c} = ?' for c in cols)} WHERE id = ?",
+                [updates[c] for c in cols] + [entry_id],
+            )
+            conn.commit()
+    for uid in {owner, updates.get("user_id", owner)}:
+        _VERSIONS.bump(TAB_ENTRIES, user_id=uid)
 
 def delete_entry_by_id(entry_id: int):
     with get_conn() as conn:
         cur = conn.cursor()
+        owner = _entry_owner(cur, entry_id)
         cur.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
         conn.commit()
-
+    _VERSIONS.bump(TAB_ENTRIES, user_id=owner)
@@ -1,26 +1,248 @@
 # db_gsheets.py
 from __future__ import annotations
 
+import base64
+import contextlib
+import contextvars
 import datetime as dt
+import heapq
+import itertools
+import json
+import re
+import threading
 import time
 import random
+import zlib
+from operator import itemgetter
 from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
+import pandas as pd
 import streamlit as st
 import gspread
 from google.oauth2.service_account import Credentials
 from gspread.exceptions import APIError
 
+import archive
+import journal
+import replica
+from storage import TAB_ENTRIES, TAB_FOODS, TAB_SETTINGS, IdAllocator
+
 SHEET_ID = st.secrets["SPREADSHEET_ID"]
-TAB_FOODS = "foods"
-TAB_ENTRIES = "entries"
-TAB_SETTINGS = "settings"
+TAB_PROFILES = "profiles"
+TAB_DAILY = "daily_totals"
+TAB_ARCHIVE_MANIFEST = "entries_manifest"
+
+# Layout de settings por usuario:
+#  - "rows": una fila "user::key" por setting (pestaña settings)
+#  - "profile": UNA fila por usuario en la pestaña profiles con el perfil entero
+#    (JSON comprimido + version; control de version al guardar, ver save_profile)
+SETTINGS_LAYOUT = str(st.secrets.get("SETTINGS_LAYOUT", "rows")).strip().lower()
+
+# Verificación de escrituras:
+#  - "response": confiar en updatedRange/updatedRows del append (+ lectura acotada si es ambiguo)
+#  - "find": buscar el ID en toda la columna A (lento con históricos grandes)
+WRITE_VERIFY_MODE = "response"
+
+# Write-behind de entries: add/update/delete se guardan en un journal local (SQLite)
+# y un hilo en segundo plano los vuelca a Sheets en lotes. La UI no espera a la API.
+# Las lecturas superponen lo pendiente del journal. Desactivado por defecto.
+WRITE_BEHIND = bool(st.secrets.get("WRITE_BEHIND", False))
+WRITE_BEHIND_FLUSH_SECONDS = float(st.secrets.get("WRITE_BEHIND_FLUSH_SECONDS", 5))
+
+# Réplica local de lectura (SQLite, replica.py): foods/entries/settings se sirven
+# desde consultas locales indexadas y un hilo la reconcilia con Sheets cada
+# REPLICA_SYNC_SECONDS. Las escrituras de este proceso se aplican también a la
+# réplica (read-your-writes). Desactivada por defecto.
+READ_REPLICA = bool(st.secrets.get("READ_REPLICA", False))
+REPLICA_SYNC_SECONDS = float(st.secrets.get("REPLICA_SYNC_SECONDS", 60))
+
+# Pestaña daily_totals: una fila por (usuario, día) con los totales del día,
+# actualizada con deltas en cada add/update/delete de entries. El histórico
+# lee esta pestaña (pocas filas) en vez de toda la pestaña entries.
+DAILY_ROLLUP = bool(st.secrets.get("DAILY_ROLLUP", False))
+
+# Archivo frío de entries: las entradas con más de ARCHIVE_HORIZON_DAYS días salen
+# de la pestaña entries (la que se relee tras cada escritura) hacia:
+#  - "tabs": una pestaña por año (entries_YYYY) + pestaña entries_manifest
+#  - "parquet": ficheros locales comprimidos (archive.py)
+# El manifest guarda los totales por (usuario, día) archivado. Las lecturas
+# consultan el archivo solo si el día/rango lo necesita. 0 = desactivado.
+ARCHIVE_HORIZON_DAYS = int(st.secrets.get("ARCHIVE_HORIZON_DAYS", 0))
+ARCHIVE_TARGET = str(st.secrets.get("ARCHIVE_TARGET", "tabs")).strip().lower()
+
+# Valores tipados: se escribe RAW (números como números, fechas como serial de Sheets)
+# y se lee UNFORMATTED_VALUE + SERIAL_NUMBER, así que parsear es un cast directo
+# (sin heurísticas coma/punto ni strptime). Al activarlo, init_db migra UNA vez
+# las pestañas foods/entries existentes (ver migrate_typed_values).
+TYPED_VALUES = bool(st.secrets.get("TYPED_VALUES", False))
+
+# IDs de filas nuevas (entries / foods): tiempo + nodo + secuencia, sin lecturas.
+# Con varias réplicas de la app, un ID_NODE distinto (0-31) en cada una. Sin él el
+# nodo es aleatorio entre 32: dos réplicas lo comparten ~3% de las veces y diez
+# ~79%, y entonces dos escrituras en el mismo ms repiten ID. Declarando
+# APP_REPLICAS > 1, init_db se niega a arrancar si falta ID_NODE.
+APP_REPLICAS = int(st.secrets.get("APP_REPLICAS", 1))
+_IDS = IdAllocator(st.secrets.get("ID_NODE"))
 
 SCOPES = [
     "https://www.googleapis.com/auth/spreadsheets",
     "https://www.googleapis.com/auth/drive",
 ]
 
+# ---- Rate limiter (token bucket) delante de TODAS las llamadas a Sheets ----
+# Compartido por el proceso: las sesiones hacen cola en vez de estrellarse juntas
+# contra la cuota y luego hacer backoff juntas. Las lecturas interactivas pasan
+# antes que los refrescos en segundo plano (ver background_requests()).
+SHEETS_QUOTA_PER_MIN = float(st.secrets.get("SHEETS_QUOTA_PER_MIN", 60))
+SHEETS_BURST = int(st.secrets.get("SHEETS_BURST", 10))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+_PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+_PRIORITY = contextvars.ContextVar("gs_priority", default=PRIORITY_INTERACTIVE)
+
+
+class _TokenBucket:
+    def __init__(self, per_minute: float, burst: int):
+        self.rate = max(per_minute, 1.0) / 60.0  # tokens por segundo
+        self.capacity = float(max(burst, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._queue: List[Tuple[int, int]] = []  # heap (prioridad, orden de llegada)
+        self._seq = itertools.count()
+        self._stats = {
+            name: {"calls": 0, "waited_s": 0.0, "max_wait_s": 0.0}
+            for name in _PRIORITY_NAMES.values()
+        }
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority: int) -> float:
+        t0 = time.monotonic()
+        with self._cond:
+            me = (priority, next(self._seq))
+            heapq.heappush(self._queue, me)
+            while True:
+                self._refill()
+                head = self._queue[0] == me
+                if head and self.tokens >= 1.0:
+                    heapq.heappop(self._queue)
+                    self.tokens -= 1.0
+                    self._cond.notify_all()
+                    break
+                # Solo la cabeza de la cola sabe cuánto esperar; el resto espera a ser avisado
+                self._cond.wait((1.0 - self.tokens) / self.rate if head else None)
+
+            waited = time.monotonic() - t0
+            agg = self._stats[_PRIORITY_NAMES.get(priority, "background")]
+            agg["calls"] += 1
+            agg["waited_s"] += waited
+            agg["max_wait_s"] = max(agg["max_wait_s"], waited)
+        return waited
+
+    def drain(self) -> None:
+        """Tras un 429: vaciar el cubo para que todo el proceso frene a la vez."""
+        with self._cond:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+            self.updated = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            self._refill()
+            out: Dict[str, Any] = {
+                "tokens": round(self.tokens, 2),
+                "queued": len(self._queue),
+                "per_minute": self.rate * 60.0,
+            }
+            for name, v in self._stats.items():
+                calls = v["calls"]
+                out[name] = {
+                    "calls": calls,
+                    "avg_wait_s": (v["waited_s"] / calls) if calls else 0.0,
+                    "max_wait_s": v["max_wait_s"],
+                }
+            return out
+
+
+_LIMITER = _TokenBucket(SHEETS_QUOTA_PER_MIN, SHEETS_BURST)
+
+
+@contextlib.contextmanager
+def background_requests():
+    """
+    Marca las llamadas a Sheets del bloque como de baja prioridad (refrescos en
+    segundo plano): ceden el turno a las peticiones interactivas.
+    """
+    token = _PRIORITY.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+def rate_limiter_stats() -> Dict[str, Any]:
+    """Métricas del limitador: tokens, cola y espera media/máxima por prioridad."""
+    return _LIMITER.stats()
+
+
+def _gs_call(fn, *args, **kwargs):
+    """Una llamada a Sheets (sin reintentos) pasando por el rate limiter."""
+    _LIMITER.acquire(_PRIORITY.get())
+    return fn(*args, **kwargs)
+
+
+def _is_transient(e: APIError) -> bool:
+    """
+    ¿Merece la pena reintentar? (429 rate limit, 500/503 server errors, etc.)
+    Efectos: un 429 frena el limitador; un error de pestaña inexistente descarta
+    los handles de worksheet (ver _is_stale_handle).
+    """
+    status = None
+    try:
+        status = getattr(getattr(e, "response", None), "status_code", None)
+    except Exception:
+        status = None
+
+    if status == 429:
+        _LIMITER.drain()
+
+    # Reintentar solo en errores típicamente temporales
+    if status in (429, 500, 503) or status is None:
+        return True
+
+    if _is_stale_handle(e, status):
+        _ws_reset()
+    return False
+
+
+def _is_stale_handle(e: APIError, status) -> bool:
+    """
+    ¿El error viene de un handle obsoleto (pestaña borrada/recreada)?
+    Un 404, o un 400 que nombra un sheetId que ya no existe ("No grid with id").
+    El resto de 400 (rango inválido, payload mal formado...) no tiene nada que ver
+    con los handles y no debe tirarlos.
+    """
+    if status == 404:
+        return True
+    if status != 400:
+        return False
+    try:
+        msg = str(getattr(getattr(e, "response", None), "text", "") or e)
+    except Exception:
+        msg = ""
+    return "no grid with id" in msg.lower()
+
+
+def _backoff(attempt: int) -> None:
+    time.sleep(min(8.0, 0.6 * (2 ** attempt)) + random.random() * 0.25)
+
+
 def _retry_gs(fn, *args, **kwargs):
     """
     Reintentos para fallos temporales de Google Sheets:
@@ -29,29 +251,121 @@ def _retry_gs(fn, *args, **kwargs):
     max_tries = 6
     for attempt in range(max_tries):
         try:
-            return fn(*args, **kwargs)
+            return _gs_call(fn, *args, **kwargs)
         except APIError as e:
-            status = None
-            try:
-                status = getattr(getattr(e, "response", None), "status_code", None)
-            except Exception:
-                status = None
-
-            # Reintentar solo en errores típicamente temporales
-            if status in (429, 500, 503) or status is None:
-                sleep = min(8.0, 0.6 * (2 ** attempt)) + random.random() * 0.25
-                time.sleep(sleep)
+            if _is_transient(e):
+                _backoff(attempt)
                 continue
             raise
 
 
+def _retry_write(fn, *args, reconcile=None, **kwargs):
+    """
+    Escritura con reintentos seguros (idempotente).
+    Cada escritura lógica lleva su request ID: el ID de fila generado en cliente
+    (entries/foods), la key (settings) o el user_id (profiles).
+    Un fallo transitorio puede llegar DESPUÉS de que Sheets aplicara la escritura,
+    así que antes de reintentar se llama a reconcile(): si encuentra el request ID
+    ya escrito devuelve el resultado y no se repite (sin filas duplicadas).
+    Sin reconcile, fn debe ser idempotente por sí misma (update/batch_update de un rango fijo).
+    """
+    max_tries = 5
+    for attempt in range(max_tries):
+        try:
+            return _gs_call(fn, *args, **kwargs)
+        except APIError as e:
+            if not _is_transient(e) or attempt == max_tries - 1:
+                raise
+            _backoff(attempt)
+            if reconcile is not None:
+                done = reconcile()
+                if done is not None:
+                    return done
+
+
+def _append_reconciler(ws, request_ids: List[Any], last_col: str):
+    """
+    reconcile() para appends: busca el último request ID en la columna A.
+    Si ya está, devuelve una respuesta equivalente a la del append.
+    """
+    def _reconcile():
+        cell = _retry_gs(ws.find, str(request_ids[-1]), in_column=1)
+        if cell is None:
+            return None
+        first = cell.row - len(request_ids) + 1
+        return {
+            "updates": {
+                "updatedRange": f"'{ws.title}'!A{first}:{last_col}{cell.row}",
+                "updatedRows": len(request_ids),
+            }
+        }
+    return _reconcile
+
+
+def _delete_reconciler(ws, row_idx: int, id_value: Any):
+    """
+    reconcile() para delete_rows: busca el ID en la columna A (no en su fila de antes:
+    otra sesión puede haber insertado/borrado filas encima).
+    Si ya no está, el borrado se aplicó. Si se movió, se borra en su fila actual.
+    """
+    def _reconcile():
+        cell = _retry_gs(ws.find, str(id_value), in_column=1)
+        if cell is None:
+            return True
+        if cell.row != row_idx:
+            _retry_write(ws.delete_rows, cell.row, reconcile=_delete_reconciler(ws, cell.row, id_value))
+            return True
+        return None
+    return _reconcile
+
+
 # ---- Cache versioning helpers (evita 429 y refresca al escribir) ----
-def _cache_bump(tab_name: str) -> None:
-    k = f"_v_{tab_name}"
-    st.session_state[k] = st.session_state.get(k, 0) + 1
+# Contadores a nivel de PROCESO (no st.session_state): todas las sesiones comparten
+# la misma versión -> una sola copia cacheada por pestaña y ven las escrituras de las demás.
+# Dos niveles:
+#  - "_v_{tab}": cambia con CUALQUIER escritura en la pestaña (caches internas de db_gsheets)
+#  - "_v_{tab}::{user}" / "_v_{tab}::*": ámbito por usuario para las vistas cacheadas de la app,
+#    así que loguear una comida solo invalida las vistas de ese usuario.
+_CACHE_VERSIONS: Dict[str, int] = {}
+_CACHE_VERSIONS_LOCK = threading.Lock()
+
+# Las caches por versión solo se leen con la versión actual: guardamos la actual
+# y la anterior (la que aún esté usando una lectura en curso). Sin este tope,
+# cada escritura dejaría vivo otro snapshot completo durante el ttl.
+_KEEP_VERSIONS = 2
+_KEEP_TAB_VERSIONS = 16  # caches por (pestaña, versión): ~2 por pestaña
+
+
+def _scope(user_id: Optional[str]) -> str:
+    uid = str(user_id).strip() if user_id is not None else ""
+    return uid or "*"
+
+
+def _cache_bump(tab_name: str, user_id: Optional[str] = None, scope_only: bool = False) -> None:
+    """scope_only: solo el ámbito del usuario (escrituras aún en el journal, el Sheet no cambió)."""
+    keys = [f"_v_{tab_name}::{_scope(user_id)}"]
+    if not scope_only:
+        keys.append(f"_v_{tab_name}")
+    with _CACHE_VERSIONS_LOCK:
+        for k in keys:
+            _CACHE_VERSIONS[k] = _CACHE_VERSIONS.get(k, 0) + 1
 
 def _cache_ver(tab_name: str) -> int:
-    return st.session_state.get(f"_v_{tab_name}", 0)
+    return _CACHE_VERSIONS.get(f"_v_{tab_name}", 0)
+
+
+def data_version(tab_name: str, user_id: Optional[str] = None) -> int:
+    """
+    Versión de datos para usar como clave en st.cache_data de la app.
+    Sin user_id: cambia con cualquier escritura en la pestaña.
+    Con user_id: solo cambia con escrituras de ese usuario o globales (user_id=None).
+    """
+    if user_id is None:
+        return _cache_ver(tab_name)
+    return (
+        _CACHE_VERSIONS.get(f"_v_{tab_name}::*", 0)
+        + _CACHE_VERSIONS.get(f"_v_{tab_name}::{_scope(user_id)}", 0)
+    )
 
 
 # ---------- Helpers ----------
@@ -88,9 +402,35 @@ def _sh():
         st.stop()
 
 
+# ---- Handles de worksheet cacheados ----
+# Se resuelven todos con UNA llamada de metadata (sh.worksheets()) y se reutilizan
+# para las llamadas a la values API. Solo se descartan tras un APIError de
+# pestaña inexistente (ver _is_stale_handle), nunca por errores de cuota.
+_WS_HANDLES: Dict[str, Any] = {}
+_WS_LOCK = threading.Lock()
+
+
+def _ws_reset() -> None:
+    with _WS_LOCK:
+        _WS_HANDLES.clear()
+
+
 def _ws(tab_name: str):
-    # NO cachear worksheet: evita estados raros tras errores de API/cuota
-    return _retry_gs(_sh().worksheet, tab_name)
+    ws = _WS_HANDLES.get(tab_name)
+    if ws is not None:
+        return ws
+
+    # La llamada de metadata va FUERA del lock: si falla, _is_transient puede
+    # llamar a _ws_reset(), que también toma _WS_LOCK. El lock solo protege el swap.
+    handles = {w.title: w for w in (_retry_gs(_sh().worksheets) or [])}
+    with _WS_LOCK:
+        _WS_HANDLES.update(handles)
+        ws = _WS_HANDLES.get(tab_name)
+
+    if ws is None:
+        # No está en la lista: que gspread lance WorksheetNotFound con su mensaje
+        ws = _retry_gs(_sh().worksheet, tab_name)
+    return ws
 
 
 def _norm_col(s: str) -> str:
@@ -114,6 +454,8 @@ def _dict_to_row(header: list, data: dict) -> list:
 
 
 def _to_float(x: Any, default: float = 0.0) -> float:
+    if isinstance(x, (int, float)) and not isinstance(x, bool):
+        return float(x)  # celda tipada (UNFORMATTED_VALUE): nada que adivinar
     try:
         if x is None:
             return default
@@ -137,20 +479,9 @@ def _to_float(x: Any, default: float = 0.0) -> float:
         return default
 
 
-def _pick(d: dict, *keys: str, default: Any = "") -> Any:
-    """
-    Devuelve el primer valor existente en d para cualquiera de las keys.
-    Útil si el Sheet tiene headers tipo 'Proteínas' en vez de 'protein'.
-    """
-    for k in keys:
-        if k in d:
-            v = d.get(k, default)
-            if v is not None and str(v).strip() != "":
-                return v
-    return default
-
-
 def _to_int(x: Any, default: int = 0) -> int:
+    if isinstance(x, int) and not isinstance(x, bool):
+        return x
     try:
         if x is None or x == "":
             return default
@@ -161,6 +492,8 @@ def _to_int(x: Any, default: int = 0) -> int:
 def _norm_date(d: Any) -> str:
     if d is None:
         return ""
+    if isinstance(d, (int, float)) and not isinstance(d, bool):
+        return _from_serial(d)
     s = str(d).strip()
     if not s:
         return ""
@@ -179,15 +512,159 @@ def _norm_date(d: Any) -> str:
     return s
 
 
-@st.cache_data(ttl=300)
+# ---- Valores tipados (TYPED_VALUES) ----
+SHEETS_EPOCH = dt.date(1899, 12, 30)  # día 0 de los seriales de fecha de Sheets
+_VALUE_INPUT = "RAW" if TYPED_VALUES else "USER_ENTERED"
+_TYPED_READ = {"value_render_option": "UNFORMATTED_VALUE", "date_time_render_option": "SERIAL_NUMBER"}
+_READ_OPTS = _TYPED_READ if TYPED_VALUES else {}
+
+
+def _from_serial(n: float) -> str:
+    return (SHEETS_EPOCH + dt.timedelta(days=int(n))).isoformat()
+
+
+def _to_serial(d: Any) -> Any:
+    """Fecha -> serial de Sheets (int). Si no se reconoce se deja tal cual."""
+    try:
+        return (dt.date.fromisoformat(_norm_date(d)) - SHEETS_EPOCH).days
+    except ValueError:
+        return d
+
+
+def _entry_sheet_row(row: list) -> list:
+    """Fila de entries tal como se escribe (tipada con TYPED_VALUES; fecha ISO si no)."""
+    if not TYPED_VALUES:
+        return row
+    return [
+        _to_int(row[0]), str(row[1]), _to_serial(row[2]), str(row[3]), str(row[4]),
+        *(_to_float(v) for v in row[5:10]),
+    ]
+
+
+def _food_sheet_row(row: list) -> list:
+    if not TYPED_VALUES:
+        return row
+    return [_to_int(row[0]), str(row[1]), str(row[2]), *(_to_float(v) for v in row[3:7])]
+
+
+def _batch_params() -> Optional[Dict[str, str]]:
+    """Mismas opciones de lectura para values_batch_get (API REST, camelCase)."""
+    if not TYPED_VALUES:
+        return None
+    return {"valueRenderOption": "UNFORMATTED_VALUE", "dateTimeRenderOption": "SERIAL_NUMBER"}
+
+
+def _to_float_series(s: pd.Series) -> pd.Series:
+    """
+    Versión vectorizada de _to_float (mismas reglas coma/punto).
+    Con TYPED_VALUES los números llegan ya como número: cast directo y
+    solo el texto que quede (filas sin migrar) pasa por las heurísticas.
+    """
+    if TYPED_VALUES:
+        num = pd.to_numeric(s, errors="coerce").astype("float64")
+        rest = num.isna() & s.notna()
+        if rest.any():
+            num[rest] = _text_to_float_series(s[rest])
+        return num.fillna(0.0)
+    return _text_to_float_series(s)
+
+
+def _text_to_float_series(s: pd.Series) -> pd.Series:
+    s = s.astype(str).str.strip()
+    both = s.str.contains(",", regex=False) & s.str.contains(".", regex=False)
+    s = s.where(~both, s.str.replace(".", "", regex=False))
+    s = s.str.replace(",", ".", regex=False)
+    return pd.to_numeric(s, errors="coerce").fillna(0.0).astype("float64")
+
+
+def _norm_date_series(s: pd.Series) -> pd.Series:
+    """
+    Versión vectorizada de _norm_date -> datetime64 (NaT si no se reconoce).
+    Con TYPED_VALUES las fechas llegan como serial: conversión directa.
+    """
+    if TYPED_VALUES:
+        serial = pd.to_numeric(s, errors="coerce")
+        out = pd.to_datetime(serial, unit="D", origin=pd.Timestamp(SHEETS_EPOCH)).dt.floor("D")
+        text = out.isna() & s.notna()
+        if text.any():
+            out[text] = _norm_date_series_text(s[text])
+        return out
+    return _norm_date_series_text(s)
+
+
+def _norm_date_series_text(s: pd.Series) -> pd.Series:
+    s = s.astype(str).str.strip()
+    out = pd.to_datetime(s, format="%Y-%m-%d", errors="coerce")
+    for fmt in ("%d/%m/%Y", "%d/%m/%y", "%Y/%m/%d"):
+        miss = out.isna()
+        if not miss.any():
+            break
+        out = out.fillna(pd.to_datetime(s.where(miss), format=fmt, errors="coerce"))
+    return out
+
+
+# ---- Bootstrap: una sola values_batch_get para las pestañas frías ----
+# bootstrap_caches() deja aquí los valores (por versión) y los loaders de cada pestaña
+# los consumen en vez de hacer su propio _ws() + get_all_values.
+_PREFETCH: Dict[str, Tuple[int, list]] = {}
+_LOADED: Dict[str, int] = {}
+_PREFETCH_LOCK = threading.Lock()
+
+
+def _tab_values(tab_name: str) -> list:
+    version = _cache_ver(tab_name)
+    with _PREFETCH_LOCK:
+        hit = _PREFETCH.pop(tab_name, None)
+        _LOADED[tab_name] = version
+    if hit is not None and hit[0] == version:
+        return hit[1]
+    return _retry_gs(_ws(tab_name).get_all_values, **_READ_OPTS)
+
+
+def bootstrap_caches() -> None:
+    """
+    Primer render: trae foods, entries y settings con UNA llamada (values_batch_get)
+    en lugar de worksheet + get_all_values por pestaña. Solo pide las pestañas frías.
+    """
+    if WRITE_BEHIND:
+        _ensure_flusher()  # vuelca lo que quedara en el journal de un proceso anterior
+    if ARCHIVE_HORIZON_DAYS > 0:
+        _ensure_archiver()  # una pasada al arrancar y luego una al día
+    if all(_replica_ready(t) for t in (TAB_FOODS, TAB_ENTRIES, TAB_SETTINGS)):
+        return  # las lecturas salen de la réplica local
+    warm = (TAB_FOODS, TAB_SETTINGS, TAB_DAILY) if DAILY_ROLLUP else (TAB_FOODS, TAB_SETTINGS)
+    cold = [t for t in warm if _LOADED.get(t) != _cache_ver(t)]
+    if _ENTRIES_SYNC["frame"] is None or _ENTRIES_SYNC["full"]:
+        if _LOADED.get(TAB_ENTRIES) != _cache_ver(TAB_ENTRIES):
+            cold.append(TAB_ENTRIES)
+    if len(cold) < 2:
+        return  # con una sola pestaña fría no ganamos nada
+
+    versions = {t: _cache_ver(t) for t in cold}
+    resp = _retry_gs(_sh().values_batch_get, [f"'{t}'" for t in cold], params=_batch_params())
+    value_ranges = (resp or {}).get("valueRanges", [])
+    if len(value_ranges) != len(cold):
+        return
+
+    with _PREFETCH_LOCK:
+        for t, vr in zip(cold, value_ranges):
+            _PREFETCH[t] = (versions[t], vr.get("values", []))
+
+
+# cache_resource: UN snapshot compartido por todas las sesiones (sin copia por lectura).
+# Los consumidores solo leen; nunca mutar lo que devuelve.
+@st.cache_resource(ttl=300, max_entries=_KEEP_TAB_VERSIONS)
+def _get_tab_values_cached(tab_name: str, version: int) -> list:
+    return _tab_values(tab_name)
+
+
+@st.cache_resource(ttl=300, max_entries=_KEEP_TAB_VERSIONS)
 def _get_all_records_cached(tab_name: str, version: int):
-    ws = _ws(tab_name)
-    values = _retry_gs(ws.get_all_values)
+    return _values_to_records(_get_tab_values_cached(tab_name, version))
 
-    if not values:
-        return []
 
-    raw_headers = values[0]
+def _unique_headers(raw_headers: list) -> List[str]:
+    """Headers limpios y sin repetir: vacío -> _col_i, repetido -> nombre_i."""
     headers = []
     seen = set()
 
@@ -200,6 +677,14 @@ def _get_all_records_cached(tab_name: str, version: int):
         else:
             headers.append(h)
             seen.add(h)
+    return headers
+
+
+def _values_to_records(values: list) -> List[Dict[str, Any]]:
+    if not values:
+        return []
+
+    headers = _unique_headers(values[0])
 
     records = []
     for row in values[1:]:
@@ -215,36 +700,285 @@ def _get_all_records(tab_name: str):
     return _get_all_records_cached(tab_name, _cache_ver(tab_name))
 
 
-def _find_row_index_by_id(tab_name: str, id_value: int) -> Optional[int]:
+# ---- Índice id -> nº de fila (compartido por el proceso) ----
+# Se construye desde los records cacheados, se corrige en cada append/delete
+# y se revalida con una sola lectura de la fila antes de usarlo.
+_ROW_INDEX: Dict[str, Dict[str, int]] = {}
+_ROW_INDEX_LOCK = threading.Lock()
+
+
+def _build_row_index(ids: List[Any]) -> Dict[str, int]:
+    idx: Dict[str, int] = {}
+    for i, v in enumerate(ids, start=2):
+        k = str(v).strip()
+        if k:
+            idx.setdefault(k, i)  # como el scan lineal: gana la primera aparición
+    return idx
+
+
+def _row_index(tab_name: str) -> Dict[str, int]:
+    idx = _ROW_INDEX.get(tab_name)
+    if idx is None:
+        if tab_name == TAB_ENTRIES:
+            ids = [v or "" for v in _get_entries_frame()["id"].tolist()]
+        else:
+            # columna A = primera clave del record (mismo orden que el header)
+            ids = [next(iter(r.values()), "") for r in _get_all_records(tab_name)]
+        idx = _build_row_index(ids)
+        with _ROW_INDEX_LOCK:
+            _ROW_INDEX[tab_name] = idx
+    return idx
+
+
+def _row_index_add(tab_name: str, first_row: int, ids: List[Any]) -> None:
+    with _ROW_INDEX_LOCK:
+        idx = _ROW_INDEX.get(tab_name)
+        if idx is None:
+            return
+        for off, v in enumerate(ids):
+            idx.setdefault(str(v).strip(), first_row + off)
+
+
+def _row_index_drop(tab_name: str, row_idx: int) -> None:
+    with _ROW_INDEX_LOCK:
+        idx = _ROW_INDEX.get(tab_name)
+        if idx is None:
+            return
+        for k, r in list(idx.items()):
+            if r == row_idx:
+                del idx[k]
+            elif r > row_idx:
+                idx[k] = r - 1
+
+
+def _reload_row_index(tab_name: str, ws) -> Dict[str, int]:
+    """Rehace el índice del tab desde la columna A actual (una lectura)."""
+    col = _retry_gs(ws.col_values, 1)
+    idx = _build_row_index(col[1:])
+    with _ROW_INDEX_LOCK:
+        _ROW_INDEX[tab_name] = idx
+    return idx
+
+
+def _find_row_by_id(tab_name: str, id_value: int, last_col: str = "A") -> Tuple[Optional[int], List[str]]:
+    """
+    Localiza la fila de un ID con el índice id->fila.
+    Revalida con UNA lectura (A{fila}:{last_col}{fila}) y devuelve (fila, valores actuales).
+    Si el índice está obsoleto (otro proceso insertó/borró filas), lo reconstruye desde la columna A.
+    """
     ws = _ws(tab_name)
-    col = ws.col_values(1)  # columna A
     target = str(id_value)
-    for i, v in enumerate(col[1:], start=2):
-        if str(v).strip() == target:
-            return i
-    return None
+
+    row_idx = _row_index(tab_name).get(target)
+    if row_idx is not None:
+        vals = _retry_gs(ws.get, f"A{row_idx}:{last_col}{row_idx}", **_READ_OPTS)
+        current = list(vals[0]) if vals else []
+        if current and str(current[0]).strip() == target:
+            return row_idx, current
+
+    # Camino lento: descargar columna A y rehacer el índice
+    idx = _reload_row_index(tab_name, ws)
+
+    row_idx = idx.get(target)
+    if row_idx is None:
+        return None, []
+    if last_col == "A":
+        return row_idx, [target]
+    return row_idx, _retry_gs(ws.row_values, row_idx, **_READ_OPTS)
+
+
+def _find_row_index_by_id(tab_name: str, id_value: int) -> Optional[int]:
+    return _find_row_by_id(tab_name, id_value)[0]
+
+
+def _find_rows_by_key(
+    tab_name: str, keys: List[str], last_col: str = "A", recheck_missing: bool = False
+) -> Dict[str, Tuple[int, List[str]]]:
+    """
+    Varias claves de la columna A a la vez: {key: (fila, valores A..last_col)} de las que existen.
+    Revalida las filas del índice con UNA batch_get; si alguna no cuadra
+    (otro proceso insertó/borró filas) rehace el índice desde la columna A.
+    recheck_missing=True: si alguna clave no está en el índice, lo rehace antes
+    desde la columna A (otro proceso pudo añadirla); úsalo antes de hacer append.
+    """
+    ws = _ws(tab_name)
+    idx = _row_index(tab_name)
+    if recheck_missing and any(k not in idx for k in keys):
+        idx = _reload_row_index(tab_name, ws)
+    found = {k: idx[k] for k in keys if k in idx}
+    if not found:
+        return {}
+
+    for attempt in range(2):
+        got = _retry_gs(ws.batch_get, [f"A{r}:{last_col}{r}" for r in found.values()], **_READ_OPTS)
+        current = [list(vr[0]) if vr and vr[0] else [] for vr in (got or [])]
+        cells = [str(c[0]).strip() if c else "" for c in current]
+        if cells == list(found):
+            return {k: (r, c) for (k, r), c in zip(found.items(), current)}
+        if attempt:
+            break
+        idx = _reload_row_index(tab_name, ws)
+        found = {k: idx[k] for k in keys if k in idx}
+        if not found:
+            return {}
+    raise RuntimeError(f"No puedo resolver filas en '{tab_name}' (cambian mientras leo)")
+
+
+_A1_ROWS_RE = re.compile(r"![A-Z]+(\d+)(?::[A-Z]+(\d+))?$")
+
+
+def _a1_rows(a1_range: str) -> Optional[Tuple[int, int]]:
+    """
+    "entries!A120:J129" -> (120, 129). None si no se puede parsear.
+    """
+    m = _A1_ROWS_RE.search(str(a1_range or ""))
+    if not m:
+        return None
+    first = int(m.group(1))
+    last = int(m.group(2) or first)
+    return first, last
+
+
+def _verify_append(ws, resp: Any, ids: List[int]) -> int:
+    """
+    Verifica un append_rows sin escanear la columna A entera.
+    Devuelve el número de la primera fila escrita.
+
+    1) Si la respuesta trae updatedRange/updatedRows coherentes con el lote -> OK sin lecturas.
+    2) Si es ambigua, lee solo la cola justo después de tableRange (A{n+1}:A{n+k}).
+    3) Como último recurso, ws.find del último ID.
+    """
+    n = len(ids)
+    resp = resp if isinstance(resp, dict) else {}
+    updates = resp.get("updates") or {}
+
+    if WRITE_VERIFY_MODE == "response":
+        rows = _a1_rows(updates.get("updatedRange", ""))
+        if rows and _to_int(updates.get("updatedRows")) == n and rows[1] - rows[0] + 1 == n:
+            return rows[0]
+
+        # Lectura acotada: las filas nuevas van justo detrás de la tabla previa
+        table = _a1_rows(resp.get("tableRange", ""))
+        start = (table[1] + 1) if table else (rows[0] if rows else None)
+        if start is not None:
+            tail = _retry_gs(ws.get, f"A{start}:A{start + n + 4}")
+            got = [str(r[0]).strip() if r else "" for r in (tail or [])]
+            targets = [str(i) for i in ids]
+            for off in range(len(got) - n + 1):
+                if got[off:off + n] == targets:
+                    return start + off
+
+    cell = _gs_call(ws.find, str(ids[-1]), in_column=1)
+    if cell is None:
+        raise RuntimeError(
+            f"No encuentro el id={ids[-1]} tras escribir. "
+            "Probable: sheet equivocado o permisos."
+        )
+    return cell.row - n + 1
 
 
 # ---------- Public API ----------
 def init_db() -> None:
+    if APP_REPLICAS > 1 and not _IDS.explicit_node:
+        raise RuntimeError(
+            f"APP_REPLICAS={APP_REPLICAS} pero falta ID_NODE en secrets: con nodos aleatorios "
+            "(32 posibles) dos réplicas pueden compartir nodo y repetir IDs. "
+            "Pon un ID_NODE distinto (0-31) en cada réplica."
+        )
     try:
         sh = _sh()
-        existing = [ws.title for ws in sh.worksheets()]
+        handles = _gs_call(sh.worksheets)
+        existing = [ws.title for ws in handles]
         required = [TAB_FOODS, TAB_ENTRIES, TAB_SETTINGS]
+        if SETTINGS_LAYOUT == "profile":
+            required.append(TAB_PROFILES)
+        if DAILY_ROLLUP:
+            required.append(TAB_DAILY)
         missing = [t for t in required if t not in existing]
         if missing:
             raise RuntimeError(f"Faltan pestañas en el Sheet: {missing}. Tengo: {existing}")
+        with _WS_LOCK:
+            _WS_HANDLES.update({ws.title: ws for ws in handles})
+        if WRITE_BEHIND:
+            journal.init_journal()
+        if READ_REPLICA:
+            replica.init_replica()
     except Exception as e:
         raise RuntimeError(
             f"No puedo abrir el Google Sheet (id={SHEET_ID}) o no encuentro pestañas "
             f"foods/entries/settings. Error real: {repr(e)}"
         ) from e
 
+    if TYPED_VALUES and get_setting(TYPED_MIGRATION_KEY, "") != "1":
+        migrate_typed_values()
+        set_setting(TYPED_MIGRATION_KEY, "1")
+    if DAILY_ROLLUP:
+        _rollup_ensure_fresh()
+
+
+# ---- Migración a valores tipados (TYPED_VALUES) ----
+TYPED_MIGRATION_KEY = "_typed_values_migrated"
+
+
+def migrate_typed_values() -> Dict[str, int]:
+    """
+    Reescribe foods y entries con valores tipados (RAW): números como número y
+    entry_date como serial con formato de fecha. Las celdas se leen UNFORMATTED,
+    así que lo que ya es número/fecha se conserva exacto y solo el texto
+    ("7,5", "18/10/2026") pasa una última vez por las heurísticas.
+    Idempotente: se puede repetir. Devuelve filas reescritas por pestaña.
+    """
+    done = {}
+
+    ws = _ws(TAB_ENTRIES)
+    values = _retry_gs(ws.get_all_values, **_TYPED_READ)
+    rows = [(list(r) + [""] * 10)[:10] for r in values[1:]] if values else []
+    typed = [
+        [
+            _to_int(r[0]) or r[0], str(r[1]).strip(), _to_serial(r[2]), str(r[3]), str(r[4]),
+            *(_to_float(v) for v in r[5:10]),
+        ] if str(r[0]).strip() else r  # filas sin id: se dejan como están
+        for r in rows
+    ]
+    if typed:
+        _retry_write(ws.update, f"A2:J{1 + len(typed)}", typed, value_input_option="RAW")
+    _retry_write(_sh().batch_update, {"requests": [{
+        "repeatCell": {
+            "range": {"sheetId": ws.id, "startRowIndex": 1, "startColumnIndex": 2, "endColumnIndex": 3},
+            "cell": {"userEnteredFormat": {"numberFormat": {"type": "DATE", "pattern": "yyyy-mm-dd"}}},
+            "fields": "userEnteredFormat.numberFormat",
+        }
+    }]})
+    done[TAB_ENTRIES] = len(typed)
+
+    # foods: el header puede estar en otro orden/idioma -> columnas resueltas con el esquema
+    ws = _ws(TAB_FOODS)
+    values = _retry_gs(ws.get_all_values, **_TYPED_READ)
+    if values and len(values) > 1:
+        cols = _compile_schema(values[0], FOOD_SCHEMA)
+        width = len(values[0])
+        casts = {i: (_to_int if field == "id" else _to_float)
+                 for field, idxs in cols.items() if field not in ("name", "category") for i in idxs}
+        typed = []
+        for r in values[1:]:
+            r = (list(r) + [""] * width)[:width]
+            typed.append([casts[i](v) if i in casts and str(v).strip() != "" else v for i, v in enumerate(r)])
+        last_col = gspread.utils.rowcol_to_a1(1, width).rstrip("1")
+        _retry_write(ws.update, f"A2:{last_col}{len(values)}", typed, value_input_option="RAW")
+        done[TAB_FOODS] = len(typed)
+
+    with _ROW_INDEX_LOCK:
+        _ROW_INDEX.clear()
+    _entries_mark_full_sync()
+    for t in (TAB_ENTRIES, TAB_FOODS):
+        _cache_bump(t)
+    return done
+
 
 def seed_foods_if_empty(foods):
     ws = _ws(TAB_FOODS)
 
-    if ws.acell("A2").value or ws.acell("B2").value:
+    if _gs_call(ws.acell, "A2").value or _gs_call(ws.acell, "B2").value:
         return
 
     rows_to_add = []
@@ -261,58 +995,136 @@ def seed_foods_if_empty(foods):
         ])
         next_id += 1
 
-    ws.append_rows(rows_to_add, value_input_option="USER_ENTERED")
+    _retry_write(
+        ws.append_rows,
+        [_food_sheet_row(r) for r in rows_to_add],
+        value_input_option=_VALUE_INPUT,
+        reconcile=_append_reconciler(ws, [r[0] for r in rows_to_add], "G"),
+    )
+    _replica_write(replica.upsert, TAB_FOODS, _parse_foods([replica.COLUMNS[TAB_FOODS], *rows_to_add]))
     _cache_bump(TAB_FOODS)
 
 
-def list_categories() -> List[str]:
-    foods = _get_all_records(TAB_FOODS)
-    cats = sorted({str(f.get("category", "")).strip() for f in foods if f.get("category")})
-    return cats
+# Headers admitidos por campo de foods, en orden de preferencia
+# (el Sheet puede tener 'Proteínas' en vez de 'protein', etc.)
+FOOD_SCHEMA: Dict[str, Tuple[str, ...]] = {
+    "id": ("id", "ID"),
+    "name": ("name", "Nombre"),
+    "category": ("category", "Categoria", "Categoría"),
+    "calories": ("calories", "kcal", "Calorías", "Calorias"),
+    "protein": ("protein", "proteina", "proteínas", "proteinas", "Proteínas", "Proteinas"),
+    "carbs": ("carbs", "carbohidratos", "Carbohidratos"),
+    "fat": ("fat", "grasas", "Grasas"),
+}
 
 
-def list_foods_by_category(category: str) -> List[Dict[str, Any]]:
-    foods = _get_all_records(TAB_FOODS)
+def _compile_schema(header: list, schema: Dict[str, Tuple[str, ...]]) -> Dict[str, List[int]]:
+    """Header -> {campo: índices de columna candidatos}. Se resuelve UNA vez por snapshot."""
+    pos = {h: i for i, h in enumerate(_unique_headers(header))}
+    return {field: [pos[a] for a in aliases if a in pos] for field, aliases in schema.items()}
 
-    out = []
-    for f in foods:
-        if str(f.get("category", "")).strip() == category:
-            out.append({
-                "id": _to_int(_pick(f, "id", "ID", default=0)),
-                "name": str(_pick(f, "name", "Nombre", default="")).strip(),
-                "category": str(_pick(f, "category", "Categoria", "Categoría", default="")).strip(),
-                "calories": _to_float(_pick(f, "calories", "kcal", "Calorías", "Calorias", default=0)),
-                "protein": _to_float(_pick(f, "protein", "proteina", "proteínas", "proteinas", "Proteínas", "Proteinas", default=0)),
-                "carbs": _to_float(_pick(f, "carbs", "carbohidratos", "Carbohidratos", default=0)),
-                "fat": _to_float(_pick(f, "fat", "grasas", "Grasas", default=0)),
-            })
-    return out
 
+def _parse_foods(values: list) -> List[Dict[str, Any]]:
+    """
+    Pestaña foods (header + filas) -> records tipados, en una sola pasada.
+    El header se resuelve antes del bucle (un itemgetter con la columna de cada campo);
+    solo si un campo tiene varios headers candidatos se mira el siguiente cuando
+    la celda está vacía. Las macros se repiten mucho: cada texto se convierte una vez.
+    """
+    if len(values) < 2:
+        return []
+    cols = _compile_schema(values[0], FOOD_SCHEMA)
+    width = len(values[0]) + 1
+    blank = width - 1  # columna ficticia (siempre "") para campos sin header
+    first = itemgetter(*(idxs[0] if idxs else blank for idxs in cols.values()))
+    fallbacks = [(k, idxs[1:]) for k, idxs in enumerate(cols.values()) if len(idxs) > 1]
+    pad = [""] * width
+
+    floats: Dict[Any, float] = {}
+
+    def num(v: Any) -> float:
+        x = floats.get(v)
+        if x is None:
+            x = floats[v] = _to_float(v)
+        return x
 
-def list_all_foods() -> List[Dict[str, Any]]:
-    foods = _get_all_records(TAB_FOODS)
     out = []
-    for f in foods:
+    for row in values[1:]:
+        if len(row) < width:
+            row = list(row) + pad[len(row):]
+        elif row[blank] != "":
+            row = list(row[:blank]) + [""]  # celdas sueltas fuera del header
+        vals = first(row)
+        if fallbacks:
+            vals = list(vals)
+            for k, rest in fallbacks:
+                if str(vals[k]).strip() == "":
+                    vals[k] = next((row[i] for i in rest if str(row[i]).strip() != ""), vals[k])
+        food_id, name, category, kcal, protein, carbs, fat = vals
+        try:
+            food_id = int(food_id)
+        except (TypeError, ValueError):
+            food_id = _to_int(food_id)
         out.append({
-            "id": _to_int(_pick(f, "id", "ID", default=0)),
-            "name": str(_pick(f, "name", "Nombre", default="")).strip(),
-            "category": str(_pick(f, "category", "Categoria", "Categoría", default="")).strip(),
-            "calories": _to_float(_pick(f, "calories", "kcal", "Calorías", "Calorias", default=0)),
-            "protein": _to_float(_pick(f, "protein", "proteina", "proteínas", "proteinas", "Proteínas", "Proteinas", default=0)),
-            "carbs": _to_float(_pick(f, "carbs", "carbohidratos", "Carbohidratos", default=0)),
-            "fat": _to_float(_pick(f, "fat", "grasas", "Grasas", default=0)),
+            "id": food_id,
+            "name": str(name).strip(),
+            "category": str(category).strip(),
+            "calories": num(kcal),
+            "protein": num(protein),
+            "carbs": num(carbs),
+            "fat": num(fat),
         })
-    out.sort(key=lambda x: (x["category"], x["name"]))
     return out
 
 
+@st.cache_resource(ttl=300, max_entries=_KEEP_VERSIONS)
+def _get_foods_cached(version: int) -> Dict[str, Any]:
+    """
+    Catálogo de foods parseado UNA vez por versión:
+      all (orden categoría/nombre), by_category (orden del Sheet), categories.
+    Snapshot compartido: las funciones públicas devuelven copias.
+    """
+    foods = _parse_foods(_get_tab_values_cached(TAB_FOODS, version))
+    by_category: Dict[str, List[Dict[str, Any]]] = {}
+    for f in foods:
+        by_category.setdefault(f["category"], []).append(f)
+    return {
+        "all": sorted(foods, key=lambda x: (x["category"], x["name"])),
+        "by_category": by_category,
+        "categories": sorted(c for c in by_category if c),
+    }
+
+
+def _get_foods() -> Dict[str, Any]:
+    return _get_foods_cached(_cache_ver(TAB_FOODS))
+
+
+def list_categories() -> List[str]:
+    if _replica_ready(TAB_FOODS):
+        return replica.list_categories()
+    return list(_get_foods()["categories"])
+
+
+def list_foods_by_category(category: str) -> List[Dict[str, Any]]:
+    if _replica_ready(TAB_FOODS):
+        return replica.list_foods(category)
+    return [dict(f) for f in _get_foods()["by_category"].get(category, [])]
+
+
+def list_all_foods() -> List[Dict[str, Any]]:
+    if _replica_ready(TAB_FOODS):
+        out = replica.list_foods()
+        out.sort(key=lambda x: (x["category"], x["name"]))
+        return out
+    return [dict(f) for f in _get_foods()["all"]]
+
+
 def add_food(food: Dict[str, Any]) -> int:
     ws = _ws(TAB_FOODS)
 
-    # id sin lecturas: time_ns
-    new_id = int(time.time_ns() // 1_000_000)
+    new_id = _IDS.next_id()
 
-    ws.append_row([
+    row = [
         new_id,
         food["name"],
         food["category"],
@@ -320,19 +1132,30 @@ def add_food(food: Dict[str, Any]) -> int:
         _to_float(food.get("protein", 0)),
         _to_float(food.get("carbs", 0)),
         _to_float(food.get("fat", 0)),
-    ], value_input_option="USER_ENTERED", insert_data_option="INSERT_ROWS")
+    ]
+    resp = _retry_write(
+        ws.append_row,
+        _food_sheet_row(row),
+        value_input_option=_VALUE_INPUT,
+        insert_data_option="INSERT_ROWS",
+        reconcile=_append_reconciler(ws, [new_id], "G"),
+    )
 
+    rows = _a1_rows(((resp or {}).get("updates") or {}).get("updatedRange", ""))
+    if rows:
+        _row_index_add(TAB_FOODS, rows[0], [new_id])
+
+    _replica_write(replica.upsert, TAB_FOODS, _parse_foods([replica.COLUMNS[TAB_FOODS], row]))
     _cache_bump(TAB_FOODS)
     return new_id
 
 
 def update_food(food_id: int, updates: Dict[str, Any]) -> None:
-    row_idx = _find_row_index_by_id(TAB_FOODS, food_id)
+    row_idx, current = _find_row_by_id(TAB_FOODS, food_id, last_col="G")
     if row_idx is None:
         raise ValueError(f"No existe food id={food_id}")
 
     ws = _ws(TAB_FOODS)
-    current = ws.row_values(row_idx)
     while len(current) < 7:
         current.append("")
 
@@ -346,7 +1169,8 @@ def update_food(food_id: int, updates: Dict[str, Any]) -> None:
         str(updates.get("fat")) if updates.get("fat") is not None else current[6],
     ]
 
-    ws.update(f"A{row_idx}:G{row_idx}", [merged], value_input_option="USER_ENTERED")
+    _retry_write(ws.update, f"A{row_idx}:G{row_idx}", [_food_sheet_row(merged)], value_input_option=_VALUE_INPUT)
+    _replica_write(replica.upsert, TAB_FOODS, _parse_foods([replica.COLUMNS[TAB_FOODS], merged]))
     _cache_bump(TAB_FOODS)
 
 
@@ -354,18 +1178,16 @@ def delete_food_by_id(food_id: int) -> None:
     row_idx = _find_row_index_by_id(TAB_FOODS, food_id)
     if row_idx is None:
         return
-    _ws(TAB_FOODS).delete_rows(row_idx)
+    ws = _ws(TAB_FOODS)
+    _retry_write(ws.delete_rows, row_idx, reconcile=_delete_reconciler(ws, row_idx, food_id))
+    _row_index_drop(TAB_FOODS, row_idx)
+    _replica_write(replica.delete, TAB_FOODS, [food_id])
     _cache_bump(TAB_FOODS)
 
 
-def add_entry(entry: Dict[str, Any]) -> int:
-    ws = _ws(TAB_ENTRIES)
-
-    # ID único basado en timestamp (estable y sin lecturas previas)
-    new_id = int(dt.datetime.utcnow().timestamp() * 1000)
-
-    row_values = [
-        new_id,
+def _entry_to_row(entry_id: int, entry: Dict[str, Any]) -> list:
+    return [
+        entry_id,
         entry.get("user_id", ""),
         entry["entry_date"],
         entry["meal"],
@@ -377,107 +1199,262 @@ def add_entry(entry: Dict[str, Any]) -> int:
         _to_float(entry.get("fat", 0)),
     ]
 
-    # Escribir fila
-    ws.append_row(
-        row_values,
-        value_input_option="USER_ENTERED",
-        insert_data_option="INSERT_ROWS"
+
+def add_entries(entries: List[Dict[str, Any]]) -> List[int]:
+    """
+    Escribe varias entradas de golpe (carrito del Registro):
+    un solo append_rows, una sola verificación y una sola invalidación de caché.
+    Con WRITE_BEHIND solo se anotan en el journal y se vuelcan en segundo plano.
+    """
+    if not entries:
+        return []
+
+    new_ids = _IDS.next_ids(len(entries))
+
+    if WRITE_BEHIND:
+        ops = [
+            ("add", new_id, row[1], dict(zip(ENTRY_COLS[1:], row[1:])))
+            for new_id, row in ((i, _entry_to_row(i, e)) for i, e in zip(new_ids, entries))
+        ]
+        journal.append(TAB_ENTRIES, ops)
+        _replica_write(replica.upsert, TAB_ENTRIES, [_entry_record(op[1], op[3]) for op in ops])
+        for uid in {op[2] for op in ops}:
+            _cache_bump(TAB_ENTRIES, user_id=uid, scope_only=True)
+        _wake_flusher()
+        return new_ids
+
+    _append_entries_now(new_ids, entries)
+    return new_ids
+
+
+def _append_entries_now(new_ids: List[int], entries: List[Dict[str, Any]]) -> None:
+    ws = _ws(TAB_ENTRIES)
+    rows = [_entry_to_row(new_id, e) for new_id, e in zip(new_ids, entries)]
+
+    # Escribir filas
+    resp = _retry_write(
+        ws.append_rows,
+        [_entry_sheet_row(r) for r in rows],
+        value_input_option=_VALUE_INPUT,
+        insert_data_option="INSERT_ROWS",
+        reconcile=_append_reconciler(ws, new_ids, "J"),
     )
 
-    # Invalidar caches
-    _cache_bump(TAB_ENTRIES)
-    st.cache_data.clear()
+    # Invalidar caches (solo las de los usuarios del lote)
+    for uid in {str(e.get("user_id", "")).strip() for e in entries}:
+        _cache_bump(TAB_ENTRIES, user_id=uid)
 
-    # ✅ Verificación robusta: buscar el ID en columna A
+    # ✅ Verificación con la respuesta del append (sin rescan de columna A)
     try:
-        cell = ws.find(str(new_id), in_column=1)
-        if cell is None:
-            raise RuntimeError(
-                f"No encuentro el id={new_id} tras escribir. "
-                "Probable: sheet equivocado o permisos."
-            )
+        first_row = _verify_append(ws, resp, new_ids)
     except Exception as e:
         raise RuntimeError(
             f"No puedo verificar escritura en '{TAB_ENTRIES}'. Error: {repr(e)}"
         ) from e
 
-    return new_id
+    _row_index_add(TAB_ENTRIES, first_row, new_ids)
+    _replica_write(replica.upsert, TAB_ENTRIES, [_entry_record(r[0], dict(zip(ENTRY_COLS, r))) for r in rows])
+    _rollup_apply([(r, +1) for r in rows])
+
+
+def add_entry(entry: Dict[str, Any]) -> int:
+    return add_entries([entry])[0]
+
+ENTRY_COLS = ["id", "user_id", "entry_date", "meal", "name", "grams", "calories", "protein", "carbs", "fat"]
+MACRO_COLS = ["calories", "protein", "carbs", "fat"]
+_NO_ROWS = np.empty(0, dtype=np.intp)
 
-@st.cache_data(ttl=300)
-def _get_entries_records_cached(version: int) -> List[Dict[str, Any]]:
+
+def _entries_frame(rows: List[list], first_row: int = 2) -> pd.DataFrame:
+    """
+    Filas crudas de entries (A..J, por POSICIÓN) -> DataFrame tipado.
+    El índice del DataFrame es el nº de fila en el Sheet.
+    """
+    raw = pd.DataFrame(
+        [(list(r) + [""] * 10)[:10] for r in rows],
+        columns=ENTRY_COLS,
+        dtype=object,
+    )
+    raw.index = pd.RangeIndex(first_row, first_row + len(raw))
+
+    df = pd.DataFrame(index=raw.index)
+    df["id"] = pd.to_numeric(
+        raw["id"].astype(str).str.strip().str.replace(",", ".", regex=False), errors="coerce"
+    ).fillna(0).astype("int64")
+    df["entry_date"] = _norm_date_series(raw["entry_date"])
+    # user_id / meal / name se repiten muchísimo -> category (strings internadas)
+    for c in ("user_id", "meal", "name"):
+        df[c] = raw[c].astype(str).str.strip().astype("category")
+    for c in ["grams"] + MACRO_COLS:
+        df[c] = _to_float_series(raw[c])
+    return df[ENTRY_COLS]
+
+
+def _concat_entries(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    df = pd.concat(frames).sort_index()
+    for c in ("user_id", "meal", "name"):
+        df[c] = df[c].astype(str).astype("category")
+    return df
+
+
+# ---- Sync incremental de entries (la pestaña es casi siempre append-only) ----
+# Recordamos el último snapshot y cuántas filas tenía; tras un append solo se
+# descarga la cola A{n+1}:J. Recarga completa si hubo delete, si la última fila
+# sincronizada ya no cuadra (otro proceso borró filas) o cada ENTRIES_FULL_SYNC_SECONDS.
+# La cola no ve ediciones de otro proceso en mitad de la hoja: esas tardan como
+# mucho ENTRIES_FULL_SYNC_SECONDS en verse, lo mismo que el antiguo TTL de 300 s
+# (al vencer, _entries_version fuerza la recarga aunque la caché siga viva).
+ENTRIES_FULL_SYNC_SECONDS = 300
+
+_ENTRIES_SYNC: Dict[str, Any] = {"frame": None, "synced_at": 0.0, "full": True, "patches": {}}
+_ENTRIES_SYNC_LOCK = threading.Lock()
+
+
+def _entries_mark_full_sync() -> None:
+    with _ENTRIES_SYNC_LOCK:
+        _ENTRIES_SYNC["full"] = True
+
+
+def _entries_patch_row(row_idx: int, values: list) -> None:
+    with _ENTRIES_SYNC_LOCK:
+        _ENTRIES_SYNC["patches"][row_idx] = list(values)
+
+
+def _sync_entries_frame() -> pd.DataFrame:
+    with _ENTRIES_SYNC_LOCK:
+        prev = _ENTRIES_SYNC["frame"]
+        now = time.time()
+
+        df = None
+        if (
+            prev is not None
+            and len(prev)
+            and not _ENTRIES_SYNC["full"]
+            and now - _ENTRIES_SYNC["synced_at"] < ENTRIES_FULL_SYNC_SECONDS
+        ):
+            last = int(prev.index[-1])
+            # Leemos desde la última fila ya sincronizada para detectar desplazamientos
+            tail = _retry_gs(_ws(TAB_ENTRIES).get, f"A{last}:J", **_READ_OPTS)
+            tail = [list(r) for r in (tail or [])]
+            if tail and _to_int(tail[0][0] if tail[0] else "") == int(prev["id"].iloc[-1]):
+                frames = [prev]
+                if len(tail) > 1:
+                    frames.append(_entries_frame(tail[1:], first_row=last + 1))
+
+                patches = {r: v for r, v in _ENTRIES_SYNC["patches"].items() if r <= last}
+                if patches:
+                    frames[0] = prev.drop(index=list(patches))
+                    for r, v in patches.items():
+                        frames.append(_entries_frame([v], first_row=r))
+
+                df = _concat_entries(frames) if len(frames) > 1 else prev
+
+        if df is None:
+            values = _tab_values(TAB_ENTRIES)
+            df = _entries_frame(values[1:] if values else [])
+            _ENTRIES_SYNC["synced_at"] = now
+
+        _ENTRIES_SYNC.update(frame=df, full=False, patches={})
+        return df
+
+
+@st.cache_resource(ttl=300, max_entries=_KEEP_VERSIONS)
+def _get_entries_frame_cached(version: int) -> pd.DataFrame:
     """
     Lee la pestaña entries por POSICIÓN (A..J), no por nombre de columna.
     Evita bugs si el header está en español, con tildes o en orden distinto.
+    Se parsea UNA vez por versión a un DataFrame columnar tipado
+    (y tras un append solo se descarga la cola nueva).
+    Snapshot compartido entre sesiones: solo lectura.
     """
-    ws = _ws(TAB_ENTRIES)
-    values = ws.get_all_values()
-    if not values or len(values) < 2:
-        return []
+    return _sync_entries_frame()
 
-    out: List[Dict[str, Any]] = []
-    for row in values[1:]:
-        # Asegura 10 columnas (A..J)
-        while len(row) < 10:
-            row.append("")
 
-        out.append({
-            "id": row[0],
-            "user_id": row[1],
-            "entry_date": row[2],
-            "meal": row[3],
-            "name": row[4],
-            "grams": row[5],
-            "calories": row[6],
-            "protein": row[7],
-            "carbs": row[8],
-            "fat": row[9],
-        })
+def _entries_version() -> int:
+    """
+    Versión de entries para las caches del frame/índice. Si toca sync completo,
+    la sube: si no, un snapshot recién reconstruido por una escritura (sync de
+    cola) viviría otro TTL entero sin ver las ediciones ajenas.
+    """
+    if time.time() - _ENTRIES_SYNC["synced_at"] >= ENTRIES_FULL_SYNC_SECONDS:
+        _cache_bump(TAB_ENTRIES)
+    return _cache_ver(TAB_ENTRIES)
 
-    return out
 
+def _get_entries_frame() -> pd.DataFrame:
+    return _get_entries_frame_cached(_entries_version())
 
-def _get_entries_records() -> List[Dict[str, Any]]:
-    return _get_entries_records_cached(_cache_ver(TAB_ENTRIES))
 
+@st.cache_resource(ttl=300, max_entries=_KEEP_VERSIONS)
+def _get_entries_index_cached(version: int) -> Dict[str, Any]:
+    """
+    Índice sobre el DataFrame de entries, construido UNA vez por versión:
+      by_user_date[(user_id, "YYYY-MM-DD")] -> posiciones en frame
+      by_date["YYYY-MM-DD"]                 -> posiciones (todos los usuarios, orden del Sheet)
+    cache_resource: no se copia en cada lectura (nunca se muta).
+    """
+    return _build_entries_index(_get_entries_frame_cached(version))
 
 
+def _build_entries_index(df: pd.DataFrame) -> Dict[str, Any]:
+    iso = df["entry_date"].dt.strftime("%Y-%m-%d")
 
-def list_entries_by_date(entry_date: str, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
-    rows = _get_entries_records()
-    target = _norm_date(entry_date)
+    by_user_date = {
+        (str(u), d): pos
+        for (u, d), pos in df.groupby([df["user_id"], iso], observed=True, sort=False).indices.items()
+    }
+    by_date = dict(df.groupby(iso, sort=False).indices)
 
-    out = []
-    for r in rows:
-        d = _norm_date(r.get("entry_date", ""))
-        if d != target:
-            continue
+    return {"frame": df, "by_user_date": by_user_date, "by_date": by_date}
 
-        if user_id is not None:
-            if str(r.get("user_id", "")).strip() != str(user_id).strip():
-                continue
 
-        out.append({
-            "id": _to_int(r.get("id")),
-            "user_id": str(r.get("user_id", "")).strip(),
-            "entry_date": d,
-            "meal": str(r.get("meal", "")).strip(),
-            "name": str(r.get("name", "")).strip(),
-            "grams": _to_float(r.get("grams")),
-            "calories": _to_float(r.get("calories")),
-            "protein": _to_float(_pick(r, "protein", "proteina", "proteínas", "proteinas", "Proteínas", "Proteinas", default=0)),
-            "carbs": _to_float(r.get("carbs")),
-            "fat": _to_float(r.get("fat")),
-        })
-    return out
+def _get_entries_index() -> Dict[str, Any]:
+    return _get_entries_index_cached(_entries_version())
+
+
+def _entries_day(idx: Dict[str, Any], entry_date: str, user_id: Optional[str]) -> np.ndarray:
+    if user_id is None:
+        return idx["by_date"].get(entry_date, _NO_ROWS)
+    return idx["by_user_date"].get((str(user_id).strip(), entry_date), _NO_ROWS)
+
+
+def _frame_records(sub: pd.DataFrame) -> List[Dict[str, Any]]:
+    sub = sub.assign(entry_date=sub["entry_date"].dt.strftime("%Y-%m-%d"))
+    return sub.astype({"user_id": str, "meal": str, "name": str}).to_dict("records")
+
+
+def list_entries_by_date(entry_date: str, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    day = _norm_date(entry_date)
+    if _replica_ready(TAB_ENTRIES):
+        # La réplica ya incluye lo pendiente del journal (write-through)
+        rows = replica.list_entries_by_date(day, user_id)
+    else:
+        idx = _get_entries_index()
+        pos = _entries_day(idx, day, user_id)
+        rows = _frame_records(idx["frame"].iloc[pos]) if len(pos) else []
+
+        if WRITE_BEHIND:
+            rows = _overlay_pending_day(idx, rows, day, user_id)
+
+    if ARCHIVE_HORIZON_DAYS > 0 and day <= _get_archive_manifest()["through"]:
+        hot = {r["id"] for r in rows}
+        rows = [r for r in _archived_entries(day, user_id) if r["id"] not in hot] + rows
+    return rows
 
 
 def update_entry(entry_id: int, **updates) -> None:
-    row_idx = _find_row_index_by_id(TAB_ENTRIES, entry_id)
+    if WRITE_BEHIND:
+        _journal_entry_op("update", entry_id, {k: v for k, v in updates.items() if v is not None})
+        return
+    _update_entry_now(entry_id, updates)
+
+
+def _update_entry_now(entry_id: int, updates: Dict[str, Any]) -> None:
+    row_idx, current = _find_row_by_id(TAB_ENTRIES, entry_id, last_col="J")
     if row_idx is None:
         raise ValueError(f"No existe entry id={entry_id}")
 
     ws = _ws(TAB_ENTRIES)
-    current = ws.row_values(row_idx)
     while len(current) < 10:
         current.append("")
 
@@ -497,56 +1474,891 @@ def update_entry(entry_id: int, **updates) -> None:
         pick(8, "carbs"),
         pick(9, "fat"),
     ]
+    if TYPED_VALUES:
+        merged[2] = _norm_date(merged[2])  # leída tipada llega como serial
 
-    ws.update(f"A{row_idx}:J{row_idx}", [merged], value_input_option="USER_ENTERED")
-    _cache_bump(TAB_ENTRIES)
+    _retry_write(ws.update, f"A{row_idx}:J{row_idx}", [_entry_sheet_row(merged)], value_input_option=_VALUE_INPUT)
+    _entries_patch_row(row_idx, merged)
+    _replica_write(replica.upsert, TAB_ENTRIES, [_entry_record(entry_id, dict(zip(ENTRY_COLS, merged)))])
+    _rollup_apply([(current, -1), (merged, +1)])
+    for uid in {current[1], merged[1]}:
+        _cache_bump(TAB_ENTRIES, user_id=uid)
 
 
 def delete_entry_by_id(entry_id: int) -> None:
-    row_idx = _find_row_index_by_id(TAB_ENTRIES, entry_id)
+    if WRITE_BEHIND:
+        _journal_entry_op("delete", entry_id, {})
+        return
+    _delete_entry_now(entry_id)
+
+
+def _delete_entry_now(entry_id: int) -> None:
+    row_idx, current = _find_row_by_id(TAB_ENTRIES, entry_id, last_col="J")
     if row_idx is None:
         return
-    _ws(TAB_ENTRIES).delete_rows(row_idx)
-    _cache_bump(TAB_ENTRIES)
+    ws = _ws(TAB_ENTRIES)
+    _retry_write(ws.delete_rows, row_idx, reconcile=_delete_reconciler(ws, row_idx, entry_id))
+    _row_index_drop(TAB_ENTRIES, row_idx)
+    _entries_mark_full_sync()
+    _replica_write(replica.delete, TAB_ENTRIES, [entry_id])
+    _rollup_apply([(current, -1)])
+    _cache_bump(TAB_ENTRIES, user_id=current[1] if len(current) > 1 else None)
 
 
 def daily_totals_last_days(days: int = 30, user_id: Optional[str] = None) -> List[Tuple[str, float, float, float, float]]:
-    rows = _get_entries_records()
     today = dt.date.today()
-    start = today - dt.timedelta(days=days - 1)
+    first = (today - dt.timedelta(days=days - 1)).isoformat()
+
+    out: Dict[str, Tuple[str, float, float, float, float]] = {}
+    from_rollup = False
+    if _replica_ready(TAB_ENTRIES):
+        out = {t[0]: t for t in replica.daily_totals(first, today.isoformat(), user_id)}
+    elif _rollup_usable():
+        from_rollup = True
+        # Pestaña daily_totals: una fila precalculada por día
+        rollup = _get_daily_rollup()
+        days_map = rollup["by_date"] if user_id is None else rollup["by_user"].get(str(user_id).strip(), {})
+        for i in range(days):
+            d = (today - dt.timedelta(days=i)).isoformat()
+            if d in days_map:
+                out[d] = (d, *days_map[d])
+    else:
+        idx = _get_entries_index()
+
+        # Solo se tocan los días del rango (lookup O(1) por día) y se agrega vectorizado
+        parts = [
+            _entries_day(idx, (today - dt.timedelta(days=i)).isoformat(), user_id)
+            for i in range(days)
+        ]
+        parts = [p for p in parts if len(p)]
+        if parts:
+            sub = idx["frame"].iloc[np.concatenate(parts)]
+            agg = sub.groupby(sub["entry_date"].dt.strftime("%Y-%m-%d"), sort=True)[MACRO_COLS].sum()
+            out = {
+                d: (d, float(kcal), float(p), float(c), float(f))
+                for d, kcal, p, c, f in agg.itertuples(name=None)
+            }
+
+    if ARCHIVE_HORIZON_DAYS > 0 and not from_rollup and first <= _get_archive_manifest()["through"]:
+        # Días archivados: totales del manifest (la rollup ya los incluye)
+        manifest = _get_archive_manifest()
+        days_map = manifest["by_date"] if user_id is None else manifest["by_user"].get(str(user_id).strip(), {})
+        for d, tot in days_map.items():
+            if first <= d <= today.isoformat():
+                hot = out.get(d, (d, 0.0, 0.0, 0.0, 0.0))
+                out[d] = (d, *(a + b for a, b in zip(hot[1:], tot)))
+
+    pending = _pending_entry_ops() if WRITE_BEHIND and not _replica_ready(TAB_ENTRIES) else {"seqs": {}}
+    if pending["seqs"]:
+        # Solo se recalculan los días que tocan las operaciones pendientes
+        for d in _pending_days(_get_entries_index(), pending):
+            if not (first <= d <= today.isoformat()):
+                continue
+            rows = list_entries_by_date(d, user_id)
+            out.pop(d, None)
+            if rows:
+                out[d] = (d, *(float(sum(r[c] for r in rows)) for c in MACRO_COLS))
 
-    agg: Dict[str, Dict[str, float]] = {}
+    return [out[d] for d in sorted(out)]
 
-    for r in rows:
-        if user_id is not None:
-            if str(r.get("user_id", "")).strip() != str(user_id).strip():
-                continue
 
-        d = _norm_date(r.get("entry_date", ""))
+# ---- Pestaña daily_totals (DAILY_ROLLUP) ----
+# A key "user::YYYY-MM-DD" | B user_id | C entry_date | D calories | E protein | F carbs | G fat | H n_entries
+# Se mantiene con deltas (leer filas afectadas + 1 batch_update + 1 append_rows).
+# Si un delta falla (la escritura de entries ya está hecha) la pestaña queda marcada
+# como desfasada: el histórico vuelve a calcularse desde entries hasta rebuild_daily_rollup().
+# La marca se guarda también en settings (ROLLUP_STALE_KEY) para que sobreviva a un
+# reinicio y la vean los demás procesos; init_db reconstruye si está puesta o si la
+# pestaña está vacía (activar DAILY_ROLLUP en un Sheet con historial).
+ROLLUP_STALE_KEY = "_daily_totals_stale"
+_ROLLUP: Dict[str, Any] = {"stale": False}
+
+
+def _rollup_key(user_id: str, entry_date: str) -> str:
+    return f"{user_id}::{entry_date}"
+
+
+def _rollup_usable() -> bool:
+    if not DAILY_ROLLUP or _ROLLUP["stale"]:
+        return False
+    return get_setting(ROLLUP_STALE_KEY, "0") != "1"
+
+
+def _rollup_mark_stale() -> None:
+    _ROLLUP["stale"] = True
+    try:
+        set_setting(ROLLUP_STALE_KEY, "1")
+    except Exception:
+        pass  # al menos este proceso deja de fiarse de la pestaña
+
+
+def _rollup_ensure_fresh() -> None:
+    """Arranque: reconstruye daily_totals si está vacía o marcada como desfasada."""
+    first = _retry_gs(_ws(TAB_DAILY).get, "A2:A2")
+    if not first or get_setting(ROLLUP_STALE_KEY, "0") == "1":
+        rebuild_daily_rollup()
+
+
+@st.cache_resource(ttl=300, max_entries=_KEEP_VERSIONS)
+def _get_daily_rollup_cached(version: int) -> Dict[str, Any]:
+    """
+    daily_totals -> by_user[user][YYYY-MM-DD] = (kcal, p, c, f)
+                    by_date[YYYY-MM-DD]        = (kcal, p, c, f) sumando usuarios
+    """
+    values = _tab_values(TAB_DAILY)
+    return _daily_rows_maps(values[1:] if values else [])
+
+
+def _daily_rows_maps(rows: List[list]) -> Dict[str, Any]:
+    """
+    Filas con formato daily_totals (A key .. H n_entries) -> by_user / by_date.
+    Una key repetida (dos procesos añadieron el mismo día a la vez) se suma: cada
+    fila lleva los deltas de entradas distintas y los siguientes van a la primera.
+    """
+    by_user: Dict[str, Dict[str, Tuple[float, ...]]] = {}
+    by_date: Dict[str, List[float]] = {}
+    for row in _merge_daily_rows(rows):
+        uid, d = row[1], row[2]
+        if not d or _to_int(row[7]) <= 0:
+            continue
+        tot = tuple(_to_float(v) for v in row[3:7])
+        by_user.setdefault(uid, {})[d] = tot
+        acc = by_date.setdefault(d, [0.0] * 4)
+        for i, v in enumerate(tot):
+            acc[i] += v
+    return {"by_user": by_user, "by_date": {d: tuple(v) for d, v in by_date.items()}}
+
+
+def _get_daily_rollup() -> Dict[str, Any]:
+    return _get_daily_rollup_cached(_cache_ver(TAB_DAILY))
+
+
+# Lock por key (usuario, día): la lectura + suma + escritura de una fila de
+# daily_totals no puede intercalarse con otra sesión del mismo proceso.
+_ROLLUP_LOCKS: Dict[str, threading.Lock] = {}
+_ROLLUP_LOCKS_GUARD = threading.Lock()
+
+
+@contextlib.contextmanager
+def _rollup_locked(keys: List[str]):
+    with _ROLLUP_LOCKS_GUARD:
+        locks = [_ROLLUP_LOCKS.setdefault(k, threading.Lock()) for k in sorted(keys)]
+    with contextlib.ExitStack() as stack:
+        for lock in locks:  # siempre en el mismo orden: sin deadlocks entre lotes
+            stack.enter_context(lock)
+        yield
+
+
+def _rollup_apply(changes: List[Tuple[list, int]]) -> None:
+    """
+    changes: [(fila de entries A..J, +1 | -1), ...] -> deltas por (usuario, día).
+    Entre procesos sigue pudiendo perderse un delta si dos escriben la misma fila
+    a la vez; las keys nuevas se comprueban en la columna A antes de añadirlas.
+    """
+    if not _rollup_usable():
+        return
+
+    deltas: Dict[str, List[Any]] = {}
+    for row, sign in changes:
+        row = (list(row) + [""] * 10)[:10]
+        uid, d = str(row[1]).strip(), _norm_date(row[2])
         if not d:
             continue
+        acc = deltas.setdefault(_rollup_key(uid, d), [uid, d, 0.0, 0.0, 0.0, 0.0, 0])
+        for i in range(4):
+            acc[2 + i] += sign * _to_float(row[6 + i])
+        acc[6] += sign
+    deltas = {k: v for k, v in deltas.items() if v[6] or any(v[2:6])}
+    if not deltas:
+        return
+
+    try:
+        with _rollup_locked(list(deltas)):
+            _rollup_write(deltas)
+    except Exception:
+        _rollup_mark_stale()
+    finally:
+        for uid in {v[0] for v in deltas.values()}:
+            _cache_bump(TAB_DAILY, user_id=uid)
+
+
+def _rollup_write(deltas: Dict[str, List[Any]]) -> None:
+    ws = _ws(TAB_DAILY)
+    found = _find_rows_by_key(TAB_DAILY, list(deltas), last_col="H", recheck_missing=True)
+
+    updates = []
+    for k, (r, cur) in found.items():
+        cur = (cur + [""] * 8)[:8]
+        uid, d, *delta = deltas[k]
+        tot = [round(_to_float(cur[3 + i]) + delta[i], 4) for i in range(4)]
+        updates.append({"range": f"A{r}:H{r}", "values": [[k, uid, d, *tot, _to_int(cur[7]) + delta[4]]]})
+    if updates:
+        _retry_write(ws.batch_update, updates, value_input_option="RAW")
+
+    new_keys = [k for k in deltas if k not in found and deltas[k][6] > 0]
+    if new_keys:
+        resp = _retry_write(
+            ws.append_rows,
+            [[k, *(round(v, 4) if isinstance(v, float) else v for v in deltas[k])] for k in new_keys],
+            value_input_option="RAW",
+            insert_data_option="INSERT_ROWS",
+            reconcile=_append_reconciler(ws, new_keys, "H"),
+        )
+        rows = _a1_rows(((resp or {}).get("updates") or {}).get("updatedRange", ""))
+        if rows:
+            _row_index_add(TAB_DAILY, rows[0], new_keys)
+
+
+def rebuild_daily_rollup() -> int:
+    """
+    Recalcula daily_totals entera desde entries (primera vez o tras un delta fallido)
+    con UNA escritura. Devuelve el nº de filas (usuario, día).
+    """
+    rows = _daily_rows_from_frame(_get_entries_frame())
+    if ARCHIVE_HORIZON_DAYS > 0:
+        # Los días archivados ya no están en entries: se suman desde el manifest
+        rows = _merge_daily_rows(rows + _archive_store().read_manifest())
+
+    _overwrite_rows(_ws(TAB_DAILY), TAB_DAILY, rows, "H")
+    _ROLLUP["stale"] = False
+    if get_setting(ROLLUP_STALE_KEY, "0") != "0":
+        set_setting(ROLLUP_STALE_KEY, "0")
+    _cache_bump(TAB_DAILY)
+    return len(rows)
+
+
+def _daily_rows_from_frame(df: pd.DataFrame) -> List[list]:
+    """Frame de entries -> filas daily_totals [key, user, día, kcal, p, c, f, n]."""
+    df = df[df["entry_date"].notna()]
+    agg = (
+        df.assign(d=df["entry_date"].dt.strftime("%Y-%m-%d"), n=1)
+        .groupby([df["user_id"].astype(str), "d"], observed=True, sort=True)[MACRO_COLS + ["n"]]
+        .sum()
+    )
+    return [
+        [_rollup_key(uid, d), uid, d, *(round(float(v), 4) for v in (kcal, p, c, f)), int(n)]
+        for (uid, d), (kcal, p, c, f, n) in zip(agg.index, agg.itertuples(index=False, name=None))
+    ]
+
+
+def _merge_daily_rows(rows: List[list]) -> List[list]:
+    """Suma filas daily_totals con la misma key (usuario, día)."""
+    merged: Dict[str, list] = {}
+    for row in rows:
+        row = (list(row) + [""] * 8)[:8]
+        acc = merged.setdefault(str(row[0]), [row[0], str(row[1]).strip(), _norm_date(row[2]), 0.0, 0.0, 0.0, 0.0, 0])
+        for i in range(4):
+            acc[3 + i] = round(acc[3 + i] + _to_float(row[3 + i]), 4)
+        acc[7] += _to_int(row[7])
+    return [merged[k] for k in sorted(merged)]
 
+
+def _overwrite_rows(ws, tab_name: str, rows: List[list], last_col: str) -> None:
+    """Reescribe la pestaña (sin header) con UNA escritura, dejando en blanco las filas sobrantes."""
+    old = _retry_gs(ws.col_values, 1)
+    width = len(rows[0]) if rows else ord(last_col) - 64
+    blank = [[""] * width] * max(0, len(old) - 1 - len(rows))
+    if rows or blank:
+        _retry_write(ws.update, f"A2:{last_col}{1 + len(rows) + len(blank)}", rows + blank, value_input_option="RAW")
+    with _ROW_INDEX_LOCK:
+        _ROW_INDEX.pop(tab_name, None)
+
+
+# ---- Archivo frío de entries (ARCHIVE_HORIZON_DAYS) ----
+class _SheetsArchive:
+    """Archivo en pestañas: entries_YYYY (A..J como entries) + entries_manifest (formato daily_totals)."""
+
+    @staticmethod
+    def _tab(title: str, header: List[str]):
         try:
-            dd = dt.date.fromisoformat(d)
-        except Exception:
+            return _ws(title)
+        except gspread.WorksheetNotFound:
+            ws = _gs_call(_sh().add_worksheet, title=title, rows=1000, cols=len(header))
+            _retry_write(ws.update, f"A1:{chr(64 + len(header))}1", [header], value_input_option="RAW")
+            _ws_reset()
+            return _ws(title)
+
+    @classmethod
+    def append_rows(cls, year: int, rows: List[list]) -> int:
+        ws = cls._tab(f"{TAB_ENTRIES}_{year}", ENTRY_COLS)
+        done = {str(v).strip() for v in _retry_gs(ws.col_values, 1)[1:]}
+        new = [r for r in rows if str(r[0]) not in done]  # no duplicar si se reintenta el job
+        if new:
+            _retry_write(
+                ws.append_rows,
+                new,
+                value_input_option="RAW",
+                insert_data_option="INSERT_ROWS",
+                reconcile=_append_reconciler(ws, [r[0] for r in new], "J"),
+            )
+        return len(new)
+
+    @staticmethod
+    def read_rows(year: int) -> List[list]:
+        try:
+            ws = _ws(f"{TAB_ENTRIES}_{year}")
+        except gspread.WorksheetNotFound:
+            return []
+        values = _retry_gs(ws.get_all_values)
+        return values[1:] if values else []
+
+    @classmethod
+    def read_manifest(cls) -> List[list]:
+        try:
+            ws = _ws(TAB_ARCHIVE_MANIFEST)
+        except gspread.WorksheetNotFound:
+            return []
+        values = _retry_gs(ws.get_all_values)
+        return values[1:] if values else []
+
+    @classmethod
+    def write_manifest(cls, rows: List[list]) -> None:
+        ws = cls._tab(TAB_ARCHIVE_MANIFEST, archive.MANIFEST_COLS)
+        _overwrite_rows(ws, TAB_ARCHIVE_MANIFEST, rows, "H")
+
+
+def _archive_store():
+    """Destino del archivo: pestañas del Sheet o Parquet local (mismas funciones)."""
+    return archive if ARCHIVE_TARGET == "parquet" else _SheetsArchive
+
+
+@st.cache_resource(ttl=300, max_entries=_KEEP_VERSIONS)
+def _get_archive_manifest_cached(version: int) -> Dict[str, Any]:
+    """Manifest -> by_user / by_date (como daily_totals) + through: último día archivado."""
+    rows = _archive_store().read_manifest()
+    maps = _daily_rows_maps(rows)
+    maps["through"] = max(maps["by_date"], default="")
+    return maps
+
+
+def _get_archive_manifest() -> Dict[str, Any]:
+    return _get_archive_manifest_cached(_cache_ver(TAB_ARCHIVE_MANIFEST))
+
+
+@st.cache_resource(ttl=300, max_entries=_KEEP_TAB_VERSIONS)
+def _get_archive_year_cached(year: int, version: int) -> Dict[str, Any]:
+    """Índice (como el de entries) de un año archivado; solo se carga si se consulta ese año."""
+    return _build_entries_index(_entries_frame(_archive_store().read_rows(year)))
+
+
+def _archived_entries(day: str, user_id: Optional[str]) -> List[Dict[str, Any]]:
+    """Entradas archivadas de ese día, marcadas con archived=True (solo lectura)."""
+    try:
+        year = dt.date.fromisoformat(day).year
+    except ValueError:
+        return []
+    idx = _get_archive_year_cached(year, _cache_ver(TAB_ARCHIVE_MANIFEST))
+    pos = _entries_day(idx, day, user_id)
+    rows = _frame_records(idx["frame"].iloc[pos]) if len(pos) else []
+    for r in rows:
+        r["archived"] = True
+    return rows
+
+
+# Años cuyo manifest falta por rehacer (se apuntan ANTES de borrar de entries):
+# si el job muere entre el borrado y el manifest, la siguiente vuelta lo completa.
+ARCHIVE_PENDING_KEY = "_archive_manifest_pending"
+
+
+def _rebuild_archive_manifest(store, years: set) -> None:
+    """
+    Recalcula el manifest de esos años desde el contenido del archivo (nunca suma
+    encima del anterior) y sin los IDs que sigan en entries: así los totales de
+    entries y los del manifest nunca cuentan dos veces la misma entrada.
+    """
+    hot = _entry_ids_in_sheet()
+    keep = [r for r in store.read_manifest() if _norm_date(r[2])[:4] not in {str(y) for y in years}]
+    fresh: List[list] = []
+    for year in sorted(years):
+        df = _entries_frame(store.read_rows(year))
+        fresh += _daily_rows_from_frame(df[~df["id"].astype(str).isin(hot)])
+    store.write_manifest(_merge_daily_rows(keep + fresh))
+    _cache_bump(TAB_ARCHIVE_MANIFEST)
+
+
+def archive_old_entries(horizon_days: Optional[int] = None) -> int:
+    """
+    Mueve las entradas con fecha anterior a hoy - horizon_days al archivo:
+      1) copia al archivo por año (sin duplicar IDs: el job se puede repetir)
+      2) borra esas filas de entries con UNA batch_update (deleteDimension)
+      3) rehace el manifest de los años tocados desde el archivo
+    Devuelve cuántas entradas salieron de la pestaña entries.
+    Las entradas archivadas son de solo lectura (update/delete ya no las encuentran).
+    """
+    horizon = ARCHIVE_HORIZON_DAYS if horizon_days is None else int(horizon_days)
+    if horizon <= 0:
+        return 0
+    cutoff = pd.Timestamp(dt.date.today() - dt.timedelta(days=horizon))
+    if WRITE_BEHIND:
+        flush_journal()  # que lo pendiente esté en el Sheet antes de mover filas
+
+    store = _archive_store()
+    pending_years = {int(y) for y in str(get_setting(ARCHIVE_PENDING_KEY, "")).split(",") if y.strip()}
+    if pending_years:
+        _rebuild_archive_manifest(store, pending_years)  # una vuelta anterior murió a medias
+        set_setting(ARCHIVE_PENDING_KEY, "")
+
+    # Snapshot fresco de entries (los nº de fila tienen que ser los actuales)
+    _entries_mark_full_sync()
+    _cache_bump(TAB_ENTRIES)
+    df = _get_entries_frame()
+    old = df[df["entry_date"].notna() & (df["entry_date"] < cutoff)]
+    if not len(old):
+        return 0
+
+    records = _frame_records(old)
+    years = set()
+    for year, part in itertools.groupby(
+        sorted(zip(old["entry_date"].dt.year.tolist(), records), key=lambda x: x[0]), key=lambda x: x[0]
+    ):
+        store.append_rows(year, [[r[c] for c in ENTRY_COLS] for _, r in part])
+        years.add(int(year))
+
+    # Borrado en bloques contiguos, de abajo arriba para no desplazar los pendientes
+    ws = _ws(TAB_ENTRIES)
+    ids = {str(i) for i in old["id"].tolist()}
+    rows = sorted(int(r) for r in old.index)
+    col = _retry_gs(ws.col_values, 1)
+    if any(r > len(col) or str(col[r - 1]).strip() not in ids for r in rows):
+        raise RuntimeError("entries cambió durante el archivado; vuelve a lanzarlo")
+
+    runs = []
+    for r in rows:
+        if runs and runs[-1][1] == r - 1:
+            runs[-1][1] = r
+        else:
+            runs.append([r, r])
+    requests = [
+        {"deleteDimension": {"range": {
+            "sheetId": ws.id, "dimension": "ROWS", "startIndex": a - 1, "endIndex": b,
+        }}}
+        for a, b in reversed(runs)
+    ]
+
+    def _reconcile():
+        left = {str(v).strip() for v in _retry_gs(ws.col_values, 1)}
+        return True if not (ids & left) else None
+
+    set_setting(ARCHIVE_PENDING_KEY, ",".join(map(str, sorted(years))))
+    _retry_write(_sh().batch_update, {"requests": requests}, reconcile=_reconcile)
+
+    with _ROW_INDEX_LOCK:
+        _ROW_INDEX.pop(TAB_ENTRIES, None)
+    if _replica_ready(TAB_ENTRIES):
+        replica.delete(TAB_ENTRIES, list(map(int, ids)))  # si no, se contarían dos veces
+    _entries_mark_full_sync()
+    _cache_bump(TAB_ENTRIES)
+
+    _rebuild_archive_manifest(store, years)
+    set_setting(ARCHIVE_PENDING_KEY, "")
+    return len(rows)
+
+
+_ARCHIVER: Dict[str, Any] = {"thread": None, "last_run": None, "last_moved": 0, "last_error": None}
+_ARCHIVER_LOCK = threading.Lock()
+
+
+def archive_status() -> Dict[str, Any]:
+    """Estado del job de archivado (para el panel de debug)."""
+    return {k: v for k, v in _ARCHIVER.items() if k != "thread"}
+
+
+def _archiver_loop() -> None:
+    while True:
+        try:
+            _ARCHIVER["last_moved"] = archive_old_entries()
+            _ARCHIVER["last_error"] = None
+        except Exception as e:
+            # Se reintenta en la siguiente vuelta; las lecturas no dependen del job
+            _ARCHIVER["last_error"] = repr(e)
+        _ARCHIVER["last_run"] = dt.datetime.now().isoformat(timespec="seconds")
+        time.sleep(24 * 3600)
+
+
+def _ensure_archiver() -> None:
+    with _ARCHIVER_LOCK:
+        t = _ARCHIVER["thread"]
+        if t is not None and t.is_alive():
+            return
+        t = threading.Thread(target=_archiver_loop, name="sheets-entries-archiver", daemon=True)
+        t.start()
+        _ARCHIVER["thread"] = t
+
+
+# ---- Write-behind de entries (journal local + volcado en segundo plano) ----
+_FLUSHER: Dict[str, Any] = {"thread": None}
+_FLUSHER_LOCK = threading.Lock()
+_FLUSH_LOCK = threading.Lock()
+_FLUSH_WAKE = threading.Event()
+
+# Adds que pudieron llegar a Sheets sin ack: creados antes de arrancar este proceso
+# (otro murió a medio volcado), con algún intento fallido, o enviados por este
+# proceso sin ack todavía. Solo para esos se mira la columna A antes de escribir.
+_PROCESS_STARTED = time.time()
+_FLUSH_UNACKED: set = set()  # seqs de adds enviados en este proceso y aún sin ack
+
+
+def _entry_record(entry_id: int, fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Payload del journal -> mismo dict que devuelve list_entries_by_date."""
+    rec = {"id": int(entry_id)}
+    for c in ENTRY_COLS[1:]:
+        v = fields.get(c, "")
+        if c == "entry_date":
+            rec[c] = _norm_date(v)
+        elif c in ("user_id", "meal", "name"):
+            rec[c] = str(v).strip()
+        else:
+            rec[c] = _to_float(v)
+    return rec
+
+
+def _base_entry(idx: Dict[str, Any], entry_id: int) -> Optional[Dict[str, Any]]:
+    df = idx["frame"]
+    hit = df[df["id"] == int(entry_id)]
+    return _frame_records(hit.iloc[:1])[0] if len(hit) else None
+
+
+def _pending_entry_ops() -> Dict[str, Any]:
+    """
+    Colapsa el journal por ID (en orden de seq):
+      add+update -> add con los cambios; add+delete -> nada;
+      update+update -> un update; update+delete -> delete.
+    """
+    adds: Dict[int, Dict[str, Any]] = {}
+    updates: Dict[int, Dict[str, Any]] = {}
+    deletes: set = set()
+    seqs: Dict[int, List[int]] = {}
+    maybe_flushed: set = set()  # adds que pudieron escribirse ya (ver _FLUSH_UNACKED)
+
+    for op in journal.pending(TAB_ENTRIES):
+        eid = int(op["entity_id"])
+        seqs.setdefault(eid, []).append(op["seq"])
+        if op["op"] == "add":
+            adds[eid] = dict(op["payload"])
+            if (op["attempts"] > 0 or op["created_at"] < _PROCESS_STARTED
+                    or op["seq"] in _FLUSH_UNACKED):
+                maybe_flushed.add(eid)
+        elif op["op"] == "update":
+            if eid in adds:
+                adds[eid].update(op["payload"])
+            else:
+                updates.setdefault(eid, {}).update(op["payload"])
+        elif op["op"] == "delete":
+            if adds.pop(eid, None) is None:
+                updates.pop(eid, None)
+                deletes.add(eid)
+
+    return {"adds": adds, "updates": updates, "deletes": deletes, "seqs": seqs, "maybe_flushed": maybe_flushed}
+
+
+def _pending_days(idx: Dict[str, Any], pending: Dict[str, Any]) -> set:
+    days = {_norm_date(p.get("entry_date", "")) for p in pending["adds"].values()}
+    for eid in set(pending["updates"]) | pending["deletes"]:
+        base = _base_entry(idx, eid)
+        if base is not None:
+            days.add(base["entry_date"])
+        if "entry_date" in pending["updates"].get(eid, {}):
+            days.add(_norm_date(pending["updates"][eid]["entry_date"]))
+    days.discard("")
+    return days
+
+
+def _overlay_pending_day(
+    idx: Dict[str, Any], rows: List[Dict[str, Any]], day: str, user_id: Optional[str]
+) -> List[Dict[str, Any]]:
+    pending = _pending_entry_ops()
+    if not pending["seqs"]:
+        return rows
+
+    uid = str(user_id).strip() if user_id is not None else None
+    updates = pending["updates"]
+
+    def keep(rec: Dict[str, Any]) -> bool:
+        return rec["entry_date"] == day and (uid is None or rec["user_id"] == uid)
+
+    out = [r for r in rows if r["id"] not in pending["deletes"] and r["id"] not in updates]
+    for eid, changes in updates.items():
+        base = _base_entry(idx, eid)
+        if base is None:
             continue
+        rec = _entry_record(eid, {**base, **changes})
+        if keep(rec):
+            out.append(rec)
+
+    # Un add ya volcado (pero aún sin ack) aparece también en el frame: no duplicar
+    known = ({r["id"] for r in out} | set(idx["frame"]["id"].tolist())) if pending["adds"] else set()
+    for eid, fields in pending["adds"].items():
+        rec = _entry_record(eid, fields)
+        if eid not in known and keep(rec):
+            out.append(rec)
+    return out
 
-        if dd < start or dd > today:
+
+def _journal_entry_op(op: str, entry_id: int, payload: Dict[str, Any]) -> None:
+    """update/delete en modo write-behind: al journal, sin tocar Sheets."""
+    pending = _pending_entry_ops()
+    owner = None
+    if int(entry_id) in pending["adds"]:
+        owner = pending["adds"][int(entry_id)].get("user_id")
+    else:
+        base = _base_entry(_get_entries_index(), entry_id)
+        if base is not None:
+            owner = base["user_id"]
+
+    journal.append(TAB_ENTRIES, [(op, entry_id, owner or "", payload)])
+    if op == "delete":
+        _replica_write(replica.delete, TAB_ENTRIES, [entry_id])
+    else:
+        rec = _entry_record(entry_id, payload)
+        _replica_write(replica.patch, TAB_ENTRIES, entry_id, {k: rec[k] for k in payload if k in rec})
+    for uid in {owner, payload.get("user_id")} - {None}:
+        _cache_bump(TAB_ENTRIES, user_id=uid, scope_only=True)
+    if owner is None:
+        _cache_bump(TAB_ENTRIES, scope_only=True)
+    _wake_flusher()
+
+
+def flush_journal() -> int:
+    """
+    Vuelca el journal a Sheets: todos los adds en UN append_rows y después
+    updates/deletes uno a uno. Devuelve cuántas operaciones se confirmaron.
+    Lo llama el hilo de fondo; se puede llamar a mano (p. ej. antes de apagar).
+    """
+    with _FLUSH_LOCK, background_requests():
+        pending = _pending_entry_ops()
+        seqs = pending["seqs"]
+        done: List[int] = []
+
+        # IDs colapsados a nada (add+delete): basta con el ack
+        live = set(pending["adds"]) | set(pending["updates"]) | pending["deletes"]
+        done += [s for eid, ss in seqs.items() if eid not in live for s in ss]
+
+        if pending["adds"]:
+            done += _flush_adds(pending["adds"], seqs, pending["maybe_flushed"])
+
+        for eid, changes in pending["updates"].items():
+            try:
+                _update_entry_now(eid, changes)
+                done += seqs[eid]
+            except ValueError:
+                done += seqs[eid]  # la fila ya no existe: nada que actualizar
+            except Exception as e:
+                journal.mark_failed(seqs[eid], repr(e))
+
+        for eid in pending["deletes"]:
+            try:
+                _delete_entry_now(eid)
+                done += seqs[eid]
+            except Exception as e:
+                journal.mark_failed(seqs[eid], repr(e))
+
+        journal.ack(done)
+        _FLUSH_UNACKED.difference_update(done)
+        return len(done)
+
+
+def _flush_adds(adds: Dict[int, Dict[str, Any]], seqs: Dict[int, List[int]], maybe_flushed: set) -> List[int]:
+    """
+    Adds del journal -> UN append_rows. Idempotente entre vueltas: un add que ya
+    está en la columna A (volcado por una vuelta que murió antes del ack, o cuyo
+    _verify_append falló) solo se confirma, no se vuelve a escribir.
+    La columna A solo se descarga si hay adds en maybe_flushed; el caso normal
+    (adds nuevos) va directo al append con la verificación acotada de _verify_append.
+    Si el lote falla, se reintenta fila a fila para que un add roto no bloquee
+    a los demás (ese acaba como fallido tras journal.MAX_ATTEMPTS).
+    """
+    done: List[int] = []
+    in_sheet = _entry_ids_in_sheet() if maybe_flushed & set(adds) else set()
+    already = [eid for eid in adds if str(eid) in in_sheet]
+    if already:
+        done += [s for eid in already for s in seqs[eid]]
+        # No sabemos si esa vuelta llegó a aplicar la rollup ni a tocar las caches
+        if DAILY_ROLLUP:
+            _rollup_mark_stale()
+        _entries_mark_full_sync()
+        with _ROW_INDEX_LOCK:
+            _ROW_INDEX.pop(TAB_ENTRIES, None)
+        _cache_bump(TAB_ENTRIES)
+
+    ids = [eid for eid in adds if str(eid) not in in_sheet]
+    if not ids:
+        return done
+    _FLUSH_UNACKED.update(s for eid in ids for s in seqs[eid])
+    try:
+        _append_entries_now(ids, [adds[eid] for eid in ids])
+        return done + [s for eid in ids for s in seqs[eid]]
+    except Exception as e:
+        if len(ids) == 1:
+            journal.mark_failed(seqs[ids[0]], repr(e))
+            return done
+
+    in_sheet = _entry_ids_in_sheet()  # el lote pudo escribirse aunque fallara la verificación
+    for eid in ids:
+        try:
+            if str(eid) not in in_sheet:
+                _append_entries_now([eid], [adds[eid]])
+            done += seqs[eid]
+        except Exception as e:
+            journal.mark_failed(seqs[eid], repr(e))
+    return done
+
+
+def _entry_ids_in_sheet() -> set:
+    """IDs de la columna A de entries, leídos en el momento (sin caches)."""
+    return {str(v).strip() for v in _retry_gs(_ws(TAB_ENTRIES).col_values, 1)[1:]}
+
+
+def failed_writes() -> List[Dict[str, Any]]:
+    """Operaciones del journal que agotaron los reintentos (para revisarlas en el debug)."""
+    return journal.failed(TAB_ENTRIES) if WRITE_BEHIND else []
+
+
+def _flusher_loop() -> None:
+    failures = 0
+    while True:
+        _FLUSH_WAKE.wait(WRITE_BEHIND_FLUSH_SECONDS)
+        _FLUSH_WAKE.clear()
+        try:
+            flush_journal()
+            failures = 0
+        except Exception:
+            failures += 1
+            _backoff(min(failures, 5))
+
+
+def _ensure_flusher() -> None:
+    with _FLUSHER_LOCK:
+        t = _FLUSHER["thread"]
+        if t is not None and t.is_alive():
+            return
+        journal.init_journal()
+        t = threading.Thread(target=_flusher_loop, name="sheets-journal-flusher", daemon=True)
+        t.start()
+        _FLUSHER["thread"] = t
+
+
+def _wake_flusher() -> None:
+    _ensure_flusher()
+    _FLUSH_WAKE.set()
+
+
+def pending_writes() -> int:
+    """Operaciones del journal aún sin volcar a Sheets (0 sin WRITE_BEHIND)."""
+    return journal.count(TAB_ENTRIES) if WRITE_BEHIND else 0
+
+
+# ---- Réplica local de lectura (READ_REPLICA) ----
+_REPLICA: Dict[str, Any] = {"thread": None, "ready": None}
+_REPLICA_LOCK = threading.Lock()
+_REPLICA_WAKE = threading.Event()
+
+
+def _replica_ready(tab_name: str) -> bool:
+    """¿Se puede leer esta pestaña de la réplica? (sincronizada al menos una vez)"""
+    if not READ_REPLICA:
+        return False
+    _ensure_replica_sync()
+    return tab_name in _REPLICA["ready"]
+
+
+def _replica_write(fn, *args) -> None:
+    """
+    Write-through a la réplica tras escribir en Sheets (o en el journal).
+    Si falla, la réplica deja de servir lecturas hasta el siguiente sync completo.
+    """
+    if not READ_REPLICA:
+        return
+    try:
+        fn(*args)
+    except Exception:
+        with _REPLICA_LOCK:
+            _REPLICA["ready"] = set()
+        _REPLICA_WAKE.set()
+
+
+def _replica_snapshots(foods_values: list, settings_values: list, frame: pd.DataFrame) -> Dict[str, List[tuple]]:
+    foods = [
+        (pos, *(f[c] for c in replica.COLUMNS[TAB_FOODS]))
+        for pos, f in enumerate(_parse_foods(foods_values), start=2)
+    ]
+    settings = [
+        (pos, str(r.get("key", "")).strip(), str(r.get("value", "")))
+        for pos, r in enumerate(_values_to_records(settings_values), start=2)
+        if str(r.get("key", "")).strip()
+    ]
+    iso = frame["entry_date"].dt.strftime("%Y-%m-%d").fillna("")
+    entries = list(zip(
+        frame.index.tolist(),
+        frame["id"].tolist(),
+        frame["user_id"].astype(str).tolist(),
+        iso.tolist(),
+        frame["meal"].astype(str).tolist(),
+        frame["name"].astype(str).tolist(),
+        *(frame[c].tolist() for c in ["grams"] + MACRO_COLS),
+    ))
+    return {TAB_FOODS: foods, TAB_SETTINGS: settings, TAB_ENTRIES: entries}
+
+
+def sync_replica() -> None:
+    """
+    Reconcilia la réplica con Sheets: UNA values_batch_get (foods + settings)
+    y el sync incremental de entries (solo la cola nueva).
+    Una pestaña se salta en esta vuelta si se escribió en ella mientras se
+    descargaba (o si hay escrituras en el journal): la réplica ya tiene esa
+    escritura y el snapshot descargado es anterior.
+    """
+    tabs = (TAB_FOODS, TAB_SETTINGS, TAB_ENTRIES)
+    with background_requests():
+        versions = {t: _cache_ver(t) for t in tabs}
+        resp = _retry_gs(_sh().values_batch_get, [f"'{TAB_FOODS}'", f"'{TAB_SETTINGS}'"], params=_batch_params())
+        value_ranges = (resp or {}).get("valueRanges", [])
+        if len(value_ranges) != 2:
+            raise RuntimeError(f"values_batch_get devolvió {len(value_ranges)} rangos (esperaba 2)")
+        frame = _sync_entries_frame()
+
+    snapshots = _replica_snapshots(
+        value_ranges[0].get("values", []), value_ranges[1].get("values", []), frame
+    )
+    for t in tabs:
+        if _cache_ver(t) != versions[t]:
+            continue
+        if t == TAB_ENTRIES and WRITE_BEHIND and journal.count(TAB_ENTRIES):
             continue
+        if replica.replace(t, snapshots[t]):
+            _cache_bump(t)  # cambios de otros procesos: invalidar vistas cacheadas de la app
+        with _REPLICA_LOCK:
+            _REPLICA["ready"].add(t)
 
-        if d not in agg:
-            agg[d] = {"calories": 0.0, "protein": 0.0, "carbs": 0.0, "fat": 0.0}
 
-        agg[d]["calories"] += _to_float(r.get("calories"))
-        agg[d]["protein"] += _to_float(r.get("protein"))
-        agg[d]["carbs"] += _to_float(r.get("carbs"))
-        agg[d]["fat"] += _to_float(r.get("fat"))
+def _replica_loop() -> None:
+    failures = 0
+    while True:
+        try:
+            sync_replica()
+            failures = 0
+        except Exception:
+            # Sheets caído o sin cuota: se sigue sirviendo el último snapshot
+            failures += 1
+            _backoff(min(failures, 5))
+        _REPLICA_WAKE.wait(REPLICA_SYNC_SECONDS)
+        _REPLICA_WAKE.clear()
 
-    out = []
-    for d in sorted(agg.keys()):
-        a = agg[d]
-        out.append((d, a["calories"], a["protein"], a["carbs"], a["fat"]))
-    return out
+
+def _ensure_replica_sync() -> None:
+    t = _REPLICA["thread"]
+    if t is not None and t.is_alive():
+        return
+    with _REPLICA_LOCK:
+        t = _REPLICA["thread"]
+        if t is not None and t.is_alive():
+            return
+        replica.init_replica()
+        if _REPLICA["ready"] is None:
+            # Snapshot persistido de una ejecución anterior: se sirve desde el arranque
+            _REPLICA["ready"] = replica.synced_tabs()
+        t = threading.Thread(target=_replica_loop, name="sheets-replica-sync", daemon=True)
+        t.start()
+        _REPLICA["thread"] = t
 
 
 def _scoped_setting_key(key: str, user_id: Optional[str]) -> str:
@@ -560,6 +2372,74 @@ def _scoped_setting_key(key: str, user_id: Optional[str]) -> str:
     return f"{uid}::{k}" if uid else k
 
 
+def _setting_text(v: Any) -> str:
+    """
+    Valor de settings como texto. Con TYPED_VALUES la pestaña se lee UNFORMATTED,
+    y lo que se escribió antes con USER_ENTERED vuelve como número ("1" -> 1) o
+    booleano: aquí se devuelve a la forma de texto que esperan los lectores.
+    """
+    if isinstance(v, bool):
+        return "TRUE" if v else "FALSE"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+
+@st.cache_resource(ttl=300, max_entries=_KEEP_VERSIONS)
+def _get_settings_map_cached(version: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Pestaña settings -> dicts por usuario, construidos UNA vez por versión:
+      global: {key: value}
+      own:    {user: {key: value}}             (solo las del usuario)
+      merged: {user: {**global, **own[user]}}  (fallback global ya aplicado)
+    Como el scan lineal original: si una key se repite, gana la primera fila.
+    Los valores siempre son texto (ver _setting_text).
+    """
+    glob: Dict[str, Any] = {}
+    own: Dict[str, Dict[str, Any]] = {}
+
+    records = replica.settings_records() if _replica_ready(TAB_SETTINGS) else _get_all_records_cached(TAB_SETTINGS, version)
+    for r in records:
+        k = str(r.get("key", "")).strip()
+        if not k:
+            continue
+        v = _setting_text(r.get("value", ""))
+        uid, sep, name = k.partition("::")
+        if sep:
+            own.setdefault(uid, {}).setdefault(name, v)
+        else:
+            glob.setdefault(k, v)
+
+    merged = {uid: {**glob, **kv} for uid, kv in own.items()}
+    return {"global": glob, "own": own, "merged": merged}
+
+
+def _settings_for(user_id: Optional[str], fallback_global: bool = True) -> Dict[str, Any]:
+    m = _get_settings_map_cached(_cache_ver(TAB_SETTINGS))
+    uid = str(user_id).strip() if user_id is not None else ""
+    if not uid:
+        return m["global"]
+
+    base = m["merged"].get(uid, m["global"]) if fallback_global else m["own"].get(uid, {})
+    if SETTINGS_LAYOUT == "profile":
+        prof = _get_profiles().get(uid)
+        if prof:
+            return {**base, **prof["settings"]}
+    return base
+
+
+def _cast_setting(v: Any, default: Any) -> Any:
+    if v is None or v == "":
+        return default
+    if isinstance(default, bool):
+        return str(v).strip().lower() in ("1", "true", "si", "sí", "yes")
+    if isinstance(default, float):
+        return _to_float(v, default)
+    if isinstance(default, int):
+        return _to_int(v, default)
+    return v
+
+
 def get_setting(
     key: str,
     default: Any = None,
@@ -570,22 +2450,24 @@ def get_setting(
     Lee setting por usuario si user_id != None.
     Si no existe y fallback_global=True, prueba también la key global (sin user).
     """
-    rows = _get_all_records(TAB_SETTINGS)
-
-    scoped = _scoped_setting_key(key, user_id)
-    for r in rows:
-        if str(r.get("key", "")).strip() == scoped:
-            v = r.get("value", "")
-            return v if v != "" else default
+    v = _settings_for(user_id, fallback_global).get(str(key).strip(), "")
+    return v if v != "" else default
 
-    if fallback_global and user_id is not None:
-        # fallback a key global (por compatibilidad con lo ya guardado)
-        for r in rows:
-            if str(r.get("key", "")).strip() == str(key).strip():
-                v = r.get("value", "")
-                return v if v != "" else default
 
-    return default
+def get_settings_many(
+    keys: Any,
+    user_id: Optional[str] = None,
+    fallback_global: bool = True,
+) -> Dict[str, Any]:
+    """
+    Varias settings en un solo lookup (mismas reglas que get_setting).
+    keys:
+      - lista de keys -> valores crudos (None si no existen)
+      - dict {key: default} -> cada valor se convierte al tipo de su default (float/int/bool/str)
+    """
+    d = _settings_for(user_id, fallback_global)
+    defaults = keys if isinstance(keys, dict) else dict.fromkeys(keys)
+    return {k: _cast_setting(d.get(str(k).strip(), ""), default) for k, default in defaults.items()}
 
 
 def set_setting(key: str, value: str, user_id: Optional[str] = None) -> None:
@@ -593,32 +2475,194 @@ def set_setting(key: str, value: str, user_id: Optional[str] = None) -> None:
     Escribe setting por usuario si user_id != None.
     No toca el valor global.
     """
+    set_settings({key: value}, user_id=user_id)
+
+
+def set_settings(values: Dict[str, Any], user_id: Optional[str] = None) -> None:
+    """
+    Upsert de varias settings de golpe (p.ej. botón Guardar de Objetivos).
+    Resuelve las keys con el índice key->fila (columna A) y escribe con
+    UN batch_update para las existentes + UN append_rows para las nuevas.
+    Una key que no está en el índice del proceso se comprueba contra la columna A
+    actual antes de añadirla: si otro proceso ya la creó, se actualiza su fila.
+    """
+    if not values:
+        return
+
+    if SETTINGS_LAYOUT == "profile" and _scope(user_id) != "*":
+        _set_profile_settings(str(user_id).strip(), values)
+        return
+
     ws = _ws(TAB_SETTINGS)
-    scoped = _scoped_setting_key(key, user_id)
+    scoped = {_scoped_setting_key(k, user_id): str(v) for k, v in values.items()}
 
-    rows = ws.get_all_records()
+    found = {k: r for k, (r, _) in _find_rows_by_key(TAB_SETTINGS, list(scoped), recheck_missing=True).items()}
 
-    for i, r in enumerate(rows, start=2):
-        if str(r.get("key", "")).strip() == scoped:
-            ws.update(f"A{i}:B{i}", [[scoped, value]], value_input_option="USER_ENTERED")
-            _cache_bump(TAB_SETTINGS)
-            return
+    if found:
+        _retry_write(
+            ws.batch_update,
+            [{"range": f"A{r}:B{r}", "values": [[k, scoped[k]]]} for k, r in found.items()],
+            value_input_option=_VALUE_INPUT,
+        )
+
+    new_keys = [k for k in scoped if k not in found]
+    if new_keys:
+        resp = _retry_write(
+            ws.append_rows,
+            [[k, scoped[k]] for k in new_keys],
+            value_input_option=_VALUE_INPUT,
+            insert_data_option="INSERT_ROWS",
+            reconcile=_append_reconciler(ws, new_keys, "B"),
+        )
+        rows = _a1_rows(((resp or {}).get("updates") or {}).get("updatedRange", ""))
+        if rows:
+            _row_index_add(TAB_SETTINGS, rows[0], new_keys)
+
+    _replica_write(replica.upsert_settings, scoped)
+    _cache_bump(TAB_SETTINGS, user_id=user_id)
+
+
+# ---------- Perfil por usuario (SETTINGS_LAYOUT = "profile") ----------
+# Pestaña profiles:  A user_id | B version | C doc
+# doc = "z1:" + base64(zlib(JSON {"v": 1, "settings": {...}}))
+PROFILE_DOC_VERSION = 1
+
+
+class ProfileConflict(RuntimeError):
+    """El perfil cambió desde que se leyó (otra sesión/proceso guardó antes)."""
+
+
+def _encode_profile(settings: Dict[str, Any]) -> str:
+    raw = json.dumps(
+        {"v": PROFILE_DOC_VERSION, "settings": settings},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+    return "z1:" + base64.b64encode(zlib.compress(raw, 9)).decode("ascii")
+
+
+def _decode_profile(doc: Any) -> Dict[str, Any]:
+    s = str(doc or "").strip()
+    if not s:
+        return {}
+    try:
+        if s.startswith("z1:"):
+            s = zlib.decompress(base64.b64decode(s[3:])).decode("utf-8")
+        data = json.loads(s)
+    except Exception:
+        return {}
+    return dict(data.get("settings", {}) or {}) if isinstance(data, dict) else {}
 
-    ws.append_row([scoped, value], value_input_option="USER_ENTERED", insert_data_option="INSERT_ROWS")
-    _cache_bump(TAB_SETTINGS)
 
+@st.cache_resource(ttl=300, max_entries=_KEEP_VERSIONS)
+def _get_profiles_cached(version: int) -> Dict[str, Dict[str, Any]]:
+    """
+    user_id -> {"version": int, "settings": dict}. Por POSICIÓN (A..C).
+    """
+    out: Dict[str, Dict[str, Any]] = {}
+    for r in _get_all_records_cached(TAB_PROFILES, version):
+        row = (list(r.values()) + ["", "", ""])[:3]
+        uid = str(row[0]).strip()
+        if uid and uid not in out:
+            out[uid] = {"version": _to_int(row[1]), "settings": _decode_profile(row[2])}
+    return out
 
 
+def _get_profiles() -> Dict[str, Dict[str, Any]]:
+    return _get_profiles_cached(_cache_ver(TAB_PROFILES))
 
 
+def get_profile(user_id: str) -> Tuple[Dict[str, Any], int]:
+    """
+    Devuelve (settings, version) del perfil del usuario.
+    Si aún no tiene fila en profiles, parte de sus settings "user::key" (version 0),
+    así la primera escritura migra el perfil.
+    """
+    uid = str(user_id).strip()
+    prof = _get_profiles().get(uid)
+    if prof:
+        return dict(prof["settings"]), prof["version"]
+    legacy = _get_settings_map_cached(_cache_ver(TAB_SETTINGS))["own"].get(uid, {})
+    return dict(legacy), 0
 
 
+_PROFILE_LOCKS: Dict[str, threading.Lock] = {}
+_PROFILE_LOCKS_GUARD = threading.Lock()
 
 
+def _profile_lock(uid: str) -> threading.Lock:
+    with _PROFILE_LOCKS_GUARD:
+        return _PROFILE_LOCKS.setdefault(uid, threading.Lock())
 
 
+def save_profile(user_id: str, settings: Dict[str, Any], expected_version: int) -> int:
+    """
+    Guarda el perfil entero en su fila (lectura de control + escritura + relectura).
+    Si la version de la hoja no es expected_version -> ProfileConflict.
+    Dentro del proceso, control y escritura van bajo un lock por usuario, así que
+    ahí sí es concurrencia optimista de verdad.
+    Entre procesos NO: Sheets no tiene escritura condicional y control, escritura y
+    relectura son llamadas separadas. Si B controla N, A controla N, A escribe y
+    relee, y luego B escribe y relee, los dos devuelven éxito y el cambio de A se
+    pierde. La relectura solo detecta una escritura ajena que caiga entre nuestra
+    escritura y nuestra relectura; es un estrechamiento de la ventana, no detección.
+    Devuelve la nueva version.
+    """
+    uid = str(user_id).strip()
+    with _profile_lock(uid):
+        new_version = _save_profile_locked(uid, settings, expected_version)
 
+    _cache_bump(TAB_PROFILES, user_id=uid)
+    _cache_bump(TAB_SETTINGS, user_id=uid)  # las vistas de settings del usuario dependen del perfil
+    return new_version
 
 
+def _save_profile_locked(uid: str, settings: Dict[str, Any], expected_version: int) -> int:
+    ws = _ws(TAB_PROFILES)
+    doc = _encode_profile(settings)
 
+    row_idx, current = _find_row_by_id(TAB_PROFILES, uid, last_col="C")
+    if row_idx is None:
+        if expected_version != 0:
+            raise ProfileConflict(f"El perfil de '{uid}' ya no existe (esperaba version={expected_version}).")
+        new_version = 1
+        resp = _retry_write(
+            ws.append_row,
+            [uid, new_version, doc],
+            value_input_option="RAW",
+            insert_data_option="INSERT_ROWS",
+            reconcile=_append_reconciler(ws, [uid], "C"),
+        )
+        rows = _a1_rows(((resp or {}).get("updates") or {}).get("updatedRange", ""))
+        if rows:
+            _row_index_add(TAB_PROFILES, rows[0], [uid])
+    else:
+        current_version = _to_int(current[1] if len(current) > 1 else 0)
+        if current_version != expected_version:
+            raise ProfileConflict(
+                f"El perfil de '{uid}' cambió (hoja={current_version}, esperaba={expected_version})."
+            )
+        new_version = current_version + 1
+        _retry_write(ws.update, f"A{row_idx}:C{row_idx}", [[uid, new_version, doc]], value_input_option="RAW")
+
+    # Relectura: pilla a otro proceso que pasó el mismo control y escribió ANTES de
+    # esta lectura. Si escribe después, nadie lo ve (ver save_profile).
+    _, stored = _find_row_by_id(TAB_PROFILES, uid, last_col="C")
+    stored = list(stored) + [""] * 3
+    if _to_int(stored[1]) != new_version or str(stored[2]) != doc:
+        _cache_bump(TAB_PROFILES, user_id=uid)
+        raise ProfileConflict(f"El perfil de '{uid}' lo guardó otra sesión a la vez (version={stored[1]}).")
+    return new_version
+
+
+def _set_profile_settings(user_id: str, values: Dict[str, Any], max_tries: int = 3) -> None:
+    for _ in range(max_tries):
+        settings, version = get_profile(user_id)
+        settings.update({str(k).strip(): str(v) for k, v in values.items()})
+        try:
+            save_profile(user_id, settings, version)
+            return
+        except ProfileConflict:
+            _cache_bump(TAB_PROFILES)  # releer perfiles y reintentar con la version nueva
+    raise ProfileConflict(f"No pude guardar el perfil de '{user_id}' tras {max_tries} intentos.")
 
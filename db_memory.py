@@ -0,0 +1,214 @@
+# db_memory.py
+"""
+Backend en memoria (mismas funciones que db_gsheets / db).
+Todo vive en el proceso y se pierde al reiniciar: pensado para pruebas,
+demos sin credenciales y como línea base en benchmarks de backends.
+"""
+from __future__ import annotations
+
+import datetime as dt
+import itertools
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from storage import DataVersions, TAB_ENTRIES, TAB_FOODS, TAB_SETTINGS, cast_setting, scoped_setting_key
+
+FOOD_COLS = ["id", "name", "category", "calories", "protein", "carbs", "fat"]
+ENTRY_COLS = ["id", "user_id", "entry_date", "meal", "name", "grams", "calories", "protein", "carbs", "fat"]
+_NUMERIC = {"grams", "calories", "protein", "carbs", "fat"}
+
+_FOODS: Dict[int, Dict[str, Any]] = {}
+_ENTRIES: Dict[int, Dict[str, Any]] = {}
+_BY_USER_DATE: Dict[Tuple[str, str], List[int]] = {}
+_SETTINGS: Dict[str, str] = {}
+
+_IDS = itertools.count(1)
+_LOCK = threading.RLock()
+_VERSIONS = DataVersions()
+
+
+def init_db() -> None:
+    return None
+
+
+def bootstrap_caches() -> None:
+    return None
+
+
+def data_version(tab_name: str, user_id: Optional[str] = None) -> int:
+    return _VERSIONS.get(tab_name, user_id)
+
+
+def reset() -> None:
+    """Vacía todo (entre pruebas / rondas de benchmark)."""
+    with _LOCK:
+        _FOODS.clear()
+        _ENTRIES.clear()
+        _BY_USER_DATE.clear()
+        _SETTINGS.clear()
+    for tab in (TAB_FOODS, TAB_ENTRIES, TAB_SETTINGS):
+        _VERSIONS.bump(tab)
+
+
+def _clean(cols: List[str], data: Dict[str, Any]) -> Dict[str, Any]:
+    out = {}
+    for c in cols:
+        if c == "id" or c not in data:
+            continue
+        out[c] = float(data[c] or 0) if c in _NUMERIC else str(data[c]).strip()
+    return out
+
+
+# ---------- Foods ----------
+def seed_foods_if_empty(foods: List[Dict[str, Any]]) -> None:
+    with _LOCK:
+        if _FOODS:
+            return
+        for f in foods:
+            add_food(f)
+
+
+def list_categories() -> List[str]:
+    with _LOCK:
+        return sorted({f["category"] for f in _FOODS.values() if f["category"]})
+
+
+def list_foods_by_category(category: str) -> List[Dict[str, Any]]:
+    with _LOCK:
+        return [dict(f) for f in _FOODS.values() if f["category"] == category]
+
+
+def list_all_foods() -> List[Dict[str, Any]]:
+    with _LOCK:
+        out = [dict(f) for f in _FOODS.values()]
+    out.sort(key=lambda x: (x["category"], x["name"]))
+    return out
+
+
+def add_food(food: Dict[str, Any]) -> int:
+    row = {"name": "", "category": "", "calories": 0.0, "protein": 0.0, "carbs": 0.0, "fat": 0.0}
+    row.update(_clean(FOOD_COLS, food))
+    with _LOCK:
+        new_id = next(_IDS)
+        _FOODS[new_id] = {"id": new_id, **row}
+    _VERSIONS.bump(TAB_FOODS)
+    return new_id
+
+
+def update_food(food_id: int, updates: Dict[str, Any]) -> None:
+    with _LOCK:
+        f = _FOODS.get(int(food_id))
+        if f is None:
+            raise ValueError(f"No existe food id={food_id}")
+        f.update(_clean(FOOD_COLS, {k: v for k, v in updates.items() if v is not None}))
+    _VERSIONS.bump(TAB_FOODS)
+
+
+def delete_food_by_id(food_id: int) -> None:
+    with _LOCK:
+        _FOODS.pop(int(food_id), None)
+    _VERSIONS.bump(TAB_FOODS)
+
+
+# ---------- Entries ----------
+def _index_add(e: Dict[str, Any]) -> None:
+    _BY_USER_DATE.setdefault((e["user_id"], e["entry_date"]), []).append(e["id"])
+
+
+def _index_drop(e: Dict[str, Any]) -> None:
+    ids = _BY_USER_DATE.get((e["user_id"], e["entry_date"]), [])
+    if e["id"] in ids:
+        ids.remove(e["id"])
+
+
+def add_entries(entries: List[Dict[str, Any]]) -> List[int]:
+    new_ids = []
+    with _LOCK:
+        for entry in entries:
+            row = {"user_id": "", "entry_date": "", "meal": "", "name": "",
+                   "grams": 0.0, "calories": 0.0, "protein": 0.0, "carbs": 0.0, "fat": 0.0}
+            row.update(_clean(ENTRY_COLS, entry))
+            new_id = next(_IDS)
+            e = {"id": new_id, **row}
+            _ENTRIES[new_id] = e
+            _index_add(e)
+            new_ids.append(new_id)
+    for uid in {str(e.get("user_id", "")).strip() for e in entries}:
+        _VERSIONS.bump(TAB_ENTRIES, user_id=uid)
+    return new_ids
+
+
+def add_entry(entry: Dict[str, Any]) -> int:
+    return add_entries([entry])[0]
+
+
+def list_entries_by_date(entry_date: str, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    with _LOCK:
+        if user_id is None:
+            return [dict(e) for e in _ENTRIES.values() if e["entry_date"] == entry_date]
+        ids = _BY_USER_DATE.get((str(user_id).strip(), entry_date), [])
+        return [dict(_ENTRIES[i]) for i in ids]
+
+
+def update_entry(entry_id: int, **updates) -> None:
+    with _LOCK:
+        e = _ENTRIES.get(int(entry_id))
+        if e is None:
+            raise ValueError(f"No existe entry id={entry_id}")
+        owner = e["user_id"]
+        _index_drop(e)
+        e.update(_clean(ENTRY_COLS, {k: v for k, v in updates.items() if v is not None}))
+        _index_add(e)
+        new_owner = e["user_id"]
+    for uid in {owner, new_owner}:
+        _VERSIONS.bump(TAB_ENTRIES, user_id=uid)
+
+
+def delete_entry_by_id(entry_id: int) -> None:
+    with _LOCK:
+        e = _ENTRIES.pop(int(entry_id), None)
+        if e is None:
+            return
+        _index_drop(e)
+    _VERSIONS.bump(TAB_ENTRIES, user_id=e["user_id"])
+
+
+def daily_totals_last_days(days: int = 30, user_id: Optional[str] = None) -> List[Tuple[str, float, float, float, float]]:
+    today = dt.date.today()
+    out = []
+    for i in range(days - 1, -1, -1):
+        d = (today - dt.timedelta(days=i)).isoformat()
+        rows = list_entries_by_date(d, user_id)
+        if rows:
+            out.append((d, *(float(sum(r[c] for r in rows)) for c in ("calories", "protein", "carbs", "fat"))))
+    return out
+
+
+# ---------- Settings ----------
+def set_settings(values: Dict[str, Any], user_id: Optional[str] = None) -> None:
+    with _LOCK:
+        for k, v in values.items():
+            _SETTINGS[scoped_setting_key(k, user_id)] = str(v)
+    _VERSIONS.bump(TAB_SETTINGS, user_id=user_id)
+
+
+def set_setting(key: str, value: str, user_id: Optional[str] = None) -> None:
+    set_settings({key: value}, user_id=user_id)
+
+
+def get_settings_many(keys: Any, user_id: Optional[str] = None, fallback_global: bool = True) -> Dict[str, Any]:
+    defaults = keys if isinstance(keys, dict) else dict.fromkeys(keys)
+    out = {}
+    with _LOCK:
+        for k, default in defaults.items():
+            name = str(k).strip()
+            v = _SETTINGS.get(scoped_setting_key(name, user_id), "")
+            if v == "" and user_id is not None and fallback_global:
+                v = _SETTINGS.get(name, "")
+            out[k] = cast_setting(v, default)
+    return out
+
+
+def get_setting(key: str, default: Any = None, user_id: Optional[str] = None, fallback_global: bool = True) -> Any:
+    v = get_settings_many([key], user_id=user_id, fallback_global=fallback_global)[key]
+    return v if v not in (None, "") else default
@@ -0,0 +1,140 @@
+# journal.py
+"""
+Journal local (SQLite) para escrituras write-behind hacia Google Sheets.
+
+Cada operación (add/update/delete) se guarda aquí al instante y un worker
+de db_gsheets la vuelca después a Sheets en lotes. Vive en el mismo fichero
+SQLite que db.py (calorie_app.db), tabla sheets_journal.
+
+Una operación que falla MAX_ATTEMPTS veces pasa a "fallida" (dead-letter):
+deja de volcarse y de contar como pendiente, pero sigue en la tabla para
+revisarla (failed) y reintentarla (requeue) o descartarla (ack).
+"""
+import json
+import sqlite3
+import time
+
+from db import DB_PATH
+
+MAX_ATTEMPTS = 8
+
+
+def get_conn():
+    return sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+
+
+def init_journal():
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS sheets_journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                tab TEXT NOT NULL,
+                op TEXT NOT NULL,
+                entity_id INTEGER NOT NULL,
+                user_id TEXT NOT NULL DEFAULT '',
+                payload TEXT NOT NULL DEFAULT '{}',
+                created_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_journal_tab ON sheets_journal(tab, seq)")
+        conn.commit()
+
+
+def append(tab: str, ops: list[tuple[str, int, str, dict]]) -> None:
+    """ops: [(op, entity_id, user_id, payload), ...] en una sola transacción."""
+    now = time.time()
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.executemany("""
+            INSERT INTO sheets_journal (tab, op, entity_id, user_id, payload, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [
+            (tab, op, int(entity_id), str(user_id or ""), json.dumps(payload, ensure_ascii=False), now)
+            for op, entity_id, user_id, payload in ops
+        ])
+        conn.commit()
+
+
+def pending(tab: str) -> list[dict]:
+    """Operaciones vivas (sin las fallidas), en orden de seq."""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT seq, op, entity_id, user_id, payload, attempts, created_at
+            FROM sheets_journal
+            WHERE tab = ? AND attempts < ?
+            ORDER BY seq
+        """, (tab, MAX_ATTEMPTS))
+        rows = cur.fetchall()
+    return [
+        {"seq": r[0], "op": r[1], "entity_id": r[2], "user_id": r[3], "payload": json.loads(r[4]),
+         "attempts": r[5], "created_at": r[6]}
+        for r in rows
+    ]
+
+
+def failed(tab: str | None = None) -> list[dict]:
+    """Operaciones que agotaron MAX_ATTEMPTS (con su último error)."""
+    where = "attempts >= ?"
+    params: list = [MAX_ATTEMPTS]
+    if tab is not None:
+        where += " AND tab = ?"
+        params.append(tab)
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT seq, tab, op, entity_id, user_id, payload, attempts, last_error, created_at
+            FROM sheets_journal
+            WHERE {where}
+            ORDER BY seq
+        """, params)
+        cols = ["seq", "tab", "op", "entity_id", "user_id", "payload", "attempts", "last_error", "created_at"]
+        return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+
+def requeue(seqs: list[int]) -> None:
+    """Vuelve a poner operaciones fallidas en la cola (attempts = 0)."""
+    if not seqs:
+        return
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.executemany("UPDATE sheets_journal SET attempts = 0 WHERE seq = ?", [(int(s),) for s in seqs])
+        conn.commit()
+
+
+def ack(seqs: list[int]) -> None:
+    if not seqs:
+        return
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.executemany("DELETE FROM sheets_journal WHERE seq = ?", [(int(s),) for s in seqs])
+        conn.commit()
+
+
+def mark_failed(seqs: list[int], error: str) -> None:
+    if not seqs:
+        return
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.executemany("""
+            UPDATE sheets_journal
+            SET attempts = attempts + 1, last_error = ?
+            WHERE seq = ?
+        """, [(str(error)[:500], int(s)) for s in seqs])
+        conn.commit()
+
+
+def count(tab: str | None = None) -> int:
+    """Operaciones pendientes de volcar (las fallidas no cuentan)."""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        if tab is None:
+            cur.execute("SELECT COUNT(*) FROM sheets_journal WHERE attempts < ?", (MAX_ATTEMPTS,))
+        else:
+            cur.execute(
+                "SELECT COUNT(*) FROM sheets_journal WHERE tab = ? AND attempts < ?", (tab, MAX_ATTEMPTS)
+            )
+        return cur.fetchone()[0]
@@ -0,0 +1,248 @@
+# replica.py
+"""
+Réplica local (SQLite) de las pestañas foods, entries y settings del Sheet.
+
+db_gsheets la reconcilia con Sheets en segundo plano y sirve las lecturas
+desde aquí: consultas indexadas en local en vez de llamadas a la API, y la
+app sigue funcionando (con el último snapshot) si Sheets no responde.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+
+REPLICA_PATH = "sheets_replica.db"
+
+# Columnas por pestaña (sin pos: nº de fila en el Sheet, para conservar el orden)
+COLUMNS = {
+    "foods": ["id", "name", "category", "calories", "protein", "carbs", "fat"],
+    "entries": ["id", "user_id", "entry_date", "meal", "name", "grams", "calories", "protein", "carbs", "fat"],
+    "settings": ["key", "value"],
+}
+
+
+def get_conn():
+    return sqlite3.connect(REPLICA_PATH, timeout=30, check_same_thread=False)
+
+
+def init_replica():
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS foods (
+                pos INTEGER PRIMARY KEY,
+                id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                category TEXT NOT NULL,
+                calories REAL NOT NULL,
+                protein REAL NOT NULL,
+                carbs REAL NOT NULL,
+                fat REAL NOT NULL
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_foods_id ON foods(id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_foods_category ON foods(category, pos)")
+
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                pos INTEGER PRIMARY KEY,
+                id INTEGER NOT NULL,
+                user_id TEXT NOT NULL,
+                entry_date TEXT NOT NULL,
+                meal TEXT NOT NULL,
+                name TEXT NOT NULL,
+                grams REAL NOT NULL,
+                calories REAL NOT NULL,
+                protein REAL NOT NULL,
+                carbs REAL NOT NULL,
+                fat REAL NOT NULL
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_entries_id ON entries(id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_entries_user_date ON entries(user_id, entry_date)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_entries_date ON entries(entry_date)")
+
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS settings (
+                pos INTEGER PRIMARY KEY,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_settings_key ON settings(key)")
+
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS sync_state (
+                tab TEXT PRIMARY KEY,
+                synced_at REAL NOT NULL,
+                digest TEXT NOT NULL
+            )
+        """)
+        conn.commit()
+
+
+def synced_tabs() -> set:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT tab FROM sync_state")
+        return {r[0] for r in cur.fetchall()}
+
+
+def replace(tab: str, rows: list[tuple]) -> bool:
+    """
+    Sustituye la pestaña entera por un snapshot de Sheets: rows = [(pos, *COLUMNS[tab]), ...].
+    Si el snapshot es idéntico al anterior no toca nada. Devuelve True si cambió.
+    """
+    digest = hashlib.sha1(json.dumps(rows, default=str).encode("utf-8")).hexdigest()
+    cols = ["pos"] + COLUMNS[tab]
+
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT digest FROM sync_state WHERE tab = ?", (tab,))
+        prev = cur.fetchone()
+        if prev is not None and prev[0] == digest:
+            cur.execute("UPDATE sync_state SET synced_at = ? WHERE tab = ?", (time.time(), tab))
+            conn.commit()
+            return False
+
+        cur.execute(f"DELETE FROM {tab}")
+        cur.executemany(
+            f"INSERT INTO {tab} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+            rows,
+        )
+        cur.execute(
+            "INSERT OR REPLACE INTO sync_state (tab, synced_at, digest) VALUES (?, ?, ?)",
+            (tab, time.time(), digest),
+        )
+        conn.commit()
+    return True
+
+
+def upsert(tab: str, records: list[dict]) -> None:
+    """Write-through de filas por id (foods/entries): actualiza si existe, si no añade al final."""
+    cols = COLUMNS[tab][1:]
+    with get_conn() as conn:
+        cur = conn.cursor()
+        for r in records:
+            vals = [r.get(c) for c in cols]
+            cur.execute(
+                f"UPDATE {tab} SET {', '.join(f'{c} = ?' for c in cols)} WHERE id = ?",
+                vals + [r["id"]],
+            )
+            if cur.rowcount == 0:
+                cur.execute(
+                    f"INSERT INTO {tab} (pos, id, {', '.join(cols)}) "
+                    f"VALUES ((SELECT COALESCE(MAX(pos), 1) + 1 FROM {tab}), ?, {', '.join('?' * len(cols))})",
+                    [r["id"]] + vals,
+                )
+        conn.commit()
+
+
+def patch(tab: str, entity_id: int, changes: dict) -> None:
+    cols = [c for c in COLUMNS[tab][1:] if c in changes]
+    if not cols:
+        return
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            f"UPDATE {tab} SET {', '.join(f'{c} = ?' for c in cols)} WHERE id = ?",
+            [changes[c] for c in cols] + [int(entity_id)],
+        )
+        conn.commit()
+
+
+def delete(tab: str, ids: list[int]) -> None:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.executemany(f"DELETE FROM {tab} WHERE id = ?", [(int(i),) for i in ids])
+        conn.commit()
+
+
+def upsert_settings(values: dict) -> None:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        for k, v in values.items():
+            cur.execute("UPDATE settings SET value = ? WHERE key = ?", (str(v), k))
+            if cur.rowcount == 0:
+                cur.execute(
+                    "INSERT INTO settings (pos, key, value) "
+                    "VALUES ((SELECT COALESCE(MAX(pos), 1) + 1 FROM settings), ?, ?)",
+                    (k, str(v)),
+                )
+        conn.commit()
+
+
+def _records(cur, tab: str) -> list[dict]:
+    cols = COLUMNS[tab]
+    return [dict(zip(cols, r)) for r in cur.fetchall()]
+
+
+def list_entries_by_date(entry_date: str, user_id: str | None = None) -> list[dict]:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        if user_id is None:
+            cur.execute("""
+                SELECT id, user_id, entry_date, meal, name, grams, calories, protein, carbs, fat
+                FROM entries
+                WHERE entry_date = ?
+                ORDER BY pos
+            """, (entry_date,))
+        else:
+            cur.execute("""
+                SELECT id, user_id, entry_date, meal, name, grams, calories, protein, carbs, fat
+                FROM entries
+                WHERE user_id = ? AND entry_date = ?
+                ORDER BY pos
+            """, (str(user_id).strip(), entry_date))
+        return _records(cur, "entries")
+
+
+def daily_totals(first_date: str, last_date: str, user_id: str | None = None) -> list[tuple]:
+    where = "entry_date BETWEEN ? AND ?"
+    params = [first_date, last_date]
+    if user_id is not None:
+        where = "user_id = ? AND " + where
+        params.insert(0, str(user_id).strip())
+
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT entry_date,
+                   SUM(calories), SUM(protein), SUM(carbs), SUM(fat)
+            FROM entries
+            WHERE {where}
+            GROUP BY entry_date
+            ORDER BY entry_date ASC
+        """, params)
+        return [(d, float(kcal), float(p), float(c), float(f)) for d, kcal, p, c, f in cur.fetchall()]
+
+
+def list_foods(category: str | None = None) -> list[dict]:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        if category is None:
+            cur.execute("SELECT id, name, category, calories, protein, carbs, fat FROM foods ORDER BY pos")
+        else:
+            cur.execute("""
+                SELECT id, name, category, calories, protein, carbs, fat
+                FROM foods
+                WHERE category = ?
+                ORDER BY pos
+            """, (category,))
+        return _records(cur, "foods")
+
+
+def list_categories() -> list[str]:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT DISTINCT category FROM foods WHERE category != ''")
+        return sorted(r[0] for r in cur.fetchall())
+
+
+def settings_records() -> list[dict]:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT key, value FROM settings ORDER BY pos")
+        return _records(cur, "settings")
@@ -0,0 +1,185 @@
+# storage.py
+"""
+Interfaz común de almacenamiento para la app.
+
+app.py solo habla con un StorageBackend; cuál se usa lo decide STORAGE_BACKEND
+en secrets:
+  - "sheets": Google Sheets (db_gsheets), el de siempre
+  - "sqlite": base de datos local (db.py), para despliegues con mucha carga
+  - "memory": en memoria del proceso (db_memory), para pruebas y benchmarks
+
+Los tres son módulos con las mismas funciones y los mismos formatos de salida
+(dicts por fila, totales diarios como tuplas), así que son intercambiables.
+"""
+from __future__ import annotations
+
+import importlib
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Protocol, Tuple
+
+import streamlit as st
+
+TAB_FOODS = "foods"
+TAB_ENTRIES = "entries"
+TAB_SETTINGS = "settings"
+
+BACKENDS = {
+    "sheets": "db_gsheets",
+    "sqlite": "db",
+    "memory": "db_memory",
+}
+
+
+class StorageBackend(Protocol):
+    """
+    Contrato de un backend. Formatos:
+      food:  {"id", "name", "category", "calories", "protein", "carbs", "fat"}
+      entry: {"id", "user_id", "entry_date" (YYYY-MM-DD), "meal", "name",
+              "grams", "calories", "protein", "carbs", "fat"}
+      daily_totals_last_days -> [(YYYY-MM-DD, kcal, protein, carbs, fat), ...] ascendente,
+      solo los días con entradas entre hoy-(days-1) y hoy.
+    Settings por usuario con fallback a la key global (sin user_id).
+    data_version(tab, user_id) cambia cuando cambian los datos que vería ese usuario
+    (clave para st.cache_data en la app).
+    """
+
+    def init_db(self) -> None: ...
+    def bootstrap_caches(self) -> None: ...
+    def data_version(self, tab_name: str, user_id: Optional[str] = None) -> int: ...
+
+    def seed_foods_if_empty(self, foods: List[Dict[str, Any]]) -> None: ...
+    def list_categories(self) -> List[str]: ...
+    def list_foods_by_category(self, category: str) -> List[Dict[str, Any]]: ...
+    def list_all_foods(self) -> List[Dict[str, Any]]: ...
+    def add_food(self, food: Dict[str, Any]) -> int: ...
+    def update_food(self, food_id: int, updates: Dict[str, Any]) -> None: ...
+    def delete_food_by_id(self, food_id: int) -> None: ...
+
+    def add_entry(self, entry: Dict[str, Any]) -> int: ...
+    def add_entries(self, entries: List[Dict[str, Any]]) -> List[int]: ...
+    def list_entries_by_date(self, entry_date: str, user_id: Optional[str] = None) -> List[Dict[str, Any]]: ...
+    def update_entry(self, entry_id: int, **updates) -> None: ...
+    def delete_entry_by_id(self, entry_id: int) -> None: ...
+    def daily_totals_last_days(
+        self, days: int = 30, user_id: Optional[str] = None
+    ) -> List[Tuple[str, float, float, float, float]]: ...
+
+    def get_setting(
+        self, key: str, default: Any = None, user_id: Optional[str] = None, fallback_global: bool = True
+    ) -> Any: ...
+    def get_settings_many(
+        self, keys: Any, user_id: Optional[str] = None, fallback_global: bool = True
+    ) -> Dict[str, Any]: ...
+    def set_setting(self, key: str, value: str, user_id: Optional[str] = None) -> None: ...
+    def set_settings(self, values: Dict[str, Any], user_id: Optional[str] = None) -> None: ...
+
+
+def backend_name() -> str:
+    name = str(st.secrets.get("STORAGE_BACKEND", "sheets")).strip().lower()
+    if name not in BACKENDS:
+        raise RuntimeError(f"STORAGE_BACKEND desconocido: {name!r}. Opciones: {sorted(BACKENDS)}")
+    return name
+
+
+def get_backend(name: Optional[str] = None) -> StorageBackend:
+    """
+    Importa (solo) el backend elegido: así un despliegue SQLite no necesita
+    credenciales de Google ni SPREADSHEET_ID.
+    """
+    return importlib.import_module(BACKENDS[name or backend_name()])
+
+
+# ---- Helpers compartidos por los backends locales (sqlite / memory) ----
+def scoped_setting_key(key: str, user_id: Optional[str]) -> str:
+    """Mismo esquema que en Sheets: "user::key" por usuario, key tal cual en global."""
+    uid = str(user_id).strip() if user_id is not None else ""
+    k = str(key).strip()
+    return f"{uid}::{k}" if uid else k
+
+
+def cast_setting(v: Any, default: Any) -> Any:
+    if v is None or v == "":
+        return default
+    if isinstance(default, bool):
+        return str(v).strip().lower() in ("1", "true", "si", "sí", "yes")
+    try:
+        if isinstance(default, float):
+            return float(str(v).strip().replace(",", "."))
+        if isinstance(default, int):
+            return int(float(str(v).strip().replace(",", ".")))
+    except ValueError:
+        return default
+    return v
+
+
+class DataVersions:
+    """
+    Contadores de versión por pestaña y por usuario (misma semántica que
+    db_gsheets.data_version): "*" son escrituras globales, que ven todos.
+    """
+
+    def __init__(self):
+        self._v: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _scope(user_id: Optional[str]) -> str:
+        uid = str(user_id).strip() if user_id is not None else ""
+        return uid or "*"
+
+    def bump(self, tab_name: str, user_id: Optional[str] = None) -> None:
+        with self._lock:
+            for k in (tab_name, f"{tab_name}::{self._scope(user_id)}"):
+                self._v[k] = self._v.get(k, 0) + 1
+
+    def get(self, tab_name: str, user_id: Optional[str] = None) -> int:
+        if user_id is None:
+            return self._v.get(tab_name, 0)
+        return self._v.get(f"{tab_name}::*", 0) + self._v.get(f"{tab_name}::{self._scope(user_id)}", 0)
+
+
+class IdAllocator:
+    """
+    IDs tipo Snowflake para las filas de Sheets (entries / foods), sin leer nada:
+      (ms desde EPOCH_MS) << 10 | nodo (5 bits) << 5 | secuencia (5 bits)
+    - Únicos dentro del proceso: la secuencia distingue el mismo ms y, si se agota,
+      se toma prestado el ms siguiente; nunca retroceden aunque el reloj lo haga.
+    - Entre procesos los separa el nodo (ID_NODE en secrets, o uno aleatorio).
+      El aleatorio es uno de solo 32: dos procesos lo comparten el ~3% de las veces,
+      5 procesos el ~28%, 10 el ~79%. Con nodo compartido, dos escrituras en el
+      mismo ms repiten ID: con varias réplicas, cada una necesita su nodo explícito.
+    - Siempre mayores que los IDs antiguos (ms Unix, ~1.7e12) y por debajo de 1e15
+      hasta ~2055: exactos como número en Sheets y sin notación científica.
+    """
+
+    EPOCH_MS = 1_704_067_200_000  # 2024-01-01 UTC
+    NODE_BITS = 5
+    SEQ_BITS = 5
+
+    def __init__(self, node: Optional[int] = None):
+        self.explicit_node = node is not None
+        if node is None:
+            node = int.from_bytes(os.urandom(2), "big") % (1 << self.NODE_BITS)
+        elif not 0 <= int(node) < (1 << self.NODE_BITS):
+            # Sin módulo: ID_NODE=33 chocaría en silencio con el nodo 1
+            raise ValueError(f"ID_NODE debe estar entre 0 y {(1 << self.NODE_BITS) - 1} (recibido {node}).")
+        self.node = int(node)
+        self._last = 0  # último (ms << SEQ_BITS | seq) emitido
+        self._lock = threading.Lock()
+
+    def next_ids(self, n: int = 1) -> List[int]:
+        with self._lock:
+            now = (int(time.time() * 1000) - self.EPOCH_MS) << self.SEQ_BITS
+            first = max(now, self._last + 1)
+            self._last = first + n - 1
+        return [
+            ((t >> self.SEQ_BITS) << (self.NODE_BITS + self.SEQ_BITS))
+            | (self.node << self.SEQ_BITS)
+            | (t & ((1 << self.SEQ_BITS) - 1))
+            for t in range(first, first + n)
+        ]
+
+    def next_id(self) -> int:
+        return self.next_ids(1)[0]